@@ -1,13 +1,37 @@
 #!/usr/bin/env python3
+"""FPGAOL CaaS Wizard
+
+Command line tool, also importable as a library:
+    caasw.generate(config, proj_dir, ...)  -> render Makefile/script for a project
+    caasw.package(config, proj_dir, ...)   -> archive a project for submission
+Both raise caasw.CaasError instead of exiting.
+"""
 import sys
 import os
 import time
 import random
+import math
 import argparse
 import configparser
 import urllib.parse
 import json
 import re
+import io
+import glob
+import shutil
+import zipfile
+import hashlib
+import email.utils
+import base64
+import contextlib
+import fcntl
+import subprocess
+import tempfile
+import mmap
+import itertools
+import codecs
+import sqlite3
+import concurrent.futures
 from pathlib import Path
 
 local_server = 'http://127.0.0.1:18888/'
@@ -15,9 +39,36 @@ upload_file = '.caas_upload.zip'
 download_file = '.caas_result.zip'
 caas_armed_file = '.caas.conf'
 jobid_file = '.jobid'
+hash_cache_file = '.caas_hashcache'
 result_dir = 'build'
 result_log_name = 'top.log'
 result_bit_name = 'top.bit'
+result_metrics_name = 'metrics.json'
+result_sim_log_name = 'sim.log'
+# errors, warnings, utilization and timing pulled out of result_log_name, see summarize_log()
+result_summary_name = 'summary.json'
+# messages of each kind kept in the summary, the rest is only counted
+summary_max_messages = 20
+# one pattern for everything a summary needs, so a log is scanned once: messages of yosys,
+# nextpnr, Vivado and Verilator, nextpnr utilisation and Fmax lines, Vivado utilization
+# table rows and its post-route timing summary. It starts at the newline before a line,
+# re skips ahead to a literal first character much faster than it tries ^ everywhere
+log_summary_re = re.compile(
+    rb'\n(?:(?P<error>(?:ERROR|%Error)[:\s-][^\n]*)'
+    rb'|(?P<warning>(?:WARNING|Warning|CRITICAL WARNING|%Warning)[:\s-][^\n]*)'
+    rb'|Info:\s+(?P<bel>\w+):\s+(?P<used>\d+)/\s*(?P<avail>\d+)\s+\d+%'
+    rb"|Info: Max frequency for clock\s+'(?P<clock>[^'\n]*)': (?P<fmax>[\d.]+) MHz \((?P<pass>PASS|FAIL) at (?P<target>[\d.]+) MHz\)"
+    rb'|\|\s*(?P<res>Slice LUTs|Slice Registers|Block RAM Tile|DSPs|Bonded IOB)\*?\s*\|\s*(?P<res_used>\d+)\s*\|'
+    rb'(?:[^|\n]*\|)*?\s*(?P<res_avail>\d+)\s*\|\s*<?[\d.]+\s*\|\s*$'
+    rb'|Post Routing Timing Summary \| WNS=(?P<wns>-?[\d.]+)\s*\| TNS=(?P<tns>-?[\d.]+))', re.M)
+# (download endpoint, file name in result_dir, label, only if the job succeeded)
+result_artifacts = [('log', result_log_name, 'Log', False),
+                    ('bitstream', result_bit_name, 'Bitstream', True)]
+# a simulation job has a waveform instead, see sim_result_artifacts()
+download_chunk_size = 1 << 16
+download_retries = 3
+# submit --follow polls download/<jobid>/log?offset= at least this often while the job runs
+log_follow_cap = 5
 # api_url = '/submit'
 
 # the default entries, these are important
@@ -29,22 +80,129 @@ bitname_default = 'top.bit'
 caas_conf_default = 'caas.conf'
 simtop_default = '' # this is empty, so Makefile will automatically pick a top
 waveform_default = 'wave.vcd'
+# [sim] simulator, icarus renders Makefile.sim and verilator Makefile.sim.verilator
+simulator_default = 'icarus'
+simulators = ['icarus', 'verilator']
+
+# already compressed formats are stored, deflating them again only burns CPU
+stored_suffixes = {'.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.7z', '.rar',
+                   '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.fst'}
+zip_chunk_size = 1 << 20
+
+# status polling: exponential backoff with jitter between poll_base and poll_cap seconds,
+# a Retry-After from the server wins but is bounded by poll_base and poll_retry_after_max,
+# a server that keeps throttling (429/503) for poll_throttled_max seconds is given up on
+poll_base = 2
+poll_cap = 30
+poll_retry_after_max = 300
+poll_throttled_max = 900
+# every submitted job is recorded in a SQLite registry, $CAAS_REGISTRY or registry_default
+registry_env = 'CAAS_REGISTRY'
+registry_default = os.path.join(os.path.expanduser('~'), '.caas', 'jobs.db')
+# caasw worker runs the projects queued under $CAAS_QUEUE or queue_default
+queue_env = 'CAAS_QUEUE'
+queue_default = os.path.join(os.path.expanduser('~'), '.caas', 'queue')
+# (backend, part prefix, memory GB, CPUs) given to one build, the first match wins
+job_resources_table = [('ice40', '', 1, 1),
+                       ('gowin', '', 2, 1),
+                       ('ecp5', 'lfe5u-85', 4, 2), ('ecp5', 'lfe5um-85', 4, 2), ('ecp5', 'lfe5um5g-85', 4, 2),
+                       ('ecp5', '', 2, 1),
+                       ('openxc7', 'xc7a35', 4, 1), ('openxc7', 'xc7a50', 4, 1), ('openxc7', 'xc7z010', 4, 1),
+                       ('openxc7', '', 8, 2),
+                       ('vivado', 'xc7k', 16, 4), ('vivado', 'xc7v', 16, 4), ('vivado', 'xcku', 16, 4),
+                       ('vivado', 'xcvu', 24, 4), ('vivado', '', 8, 2),
+                       ('sim', 'verilator', 4, 4), ('sim', '', 1, 1)]
+job_resources_default = (8, 2)
+# memory left to the host, and seconds the oldest queued job waits before smaller ones stop overtaking it
+worker_reserved_mem = 2
+worker_backfill_age = 600
+worker_poll = 1
+# DOCKER_EXEC="caasw.py pool-exec" runs builds in warm containers kept under $CAAS_POOL,
+# up to pool_size per image and options, each recycled after pool_recycle_after builds or a failure
+pool_env = 'CAAS_POOL'
+pool_default = os.path.join(os.path.expanduser('~'), '.caas', 'pool')
+pool_docker_env = 'CAAS_POOL_DOCKER'
+pool_size = 4
+pool_recycle_after = 20
+# giturl repos are cloned from bare mirrors under $CAAS_GIT_MIRROR when it is set,
+# a mirror is fetched again when its last fetch is older than git_mirror_max_age seconds
+git_mirror_env = 'CAAS_GIT_MIRROR'
+git_mirror_max_age = 300
+# a push (Server-Sent Events) connection is dropped if nothing arrives for this long
+push_read_timeout = 120
+# [caas] server may list several servers, a job goes to the one with the fewest queued and
+# running jobs per worker (GET load), plus server_latency_weight per second of its latency,
+# which is remembered across runs smoothed by server_latency_alpha
+server_probe_timeout = 2
+server_latency_weight = 10
+server_latency_alpha = 0.3
 
 term_white = "\033[37m"
 term_orig = "\033[0m"
 
-SEDEXEC = 'gsed' if sys.platform == 'darwin' else 'sed'
-
 GENERIC_MF_NAME = 'Makefile.caas'
 GENERIC_SH_NAME = 'run_caas.sh'
 GENERIC_SIM_SH_NAME = 'run_sim.sh'
 GENERIC_SIM_MF_NAME = 'Makefile.sim.caas'
+# compilation and simulation in one job, running the two Makefiles above side by side
+GENERIC_BOTH_SH_NAME = 'run_both.sh'
+GENERIC_BOTH_MF_NAME = 'Makefile.both.caas'
+# backends whose toolchain image also has the simulators, so run_both.sh can run both in it
+combined_backends = ['ice40', 'ecp5']
+# stage cache helper called by the Makefiles of these backends
+CACHE_SH_NAME = 'caas_cache.sh'
+# stage timing helper called by every Makefile
+STAGE_SH_NAME = 'caas_stage.sh'
+# picks the best place-and-route run of an [explore] sweep
+EXPLORE_SH_NAME = 'caas_explore.sh'
+# placer directives swept for vivado when [explore] lists none
+explore_directives_default = 'Explore,ExtraNetDelay_high,AltSpreadLogic_high,ExtraPostPlacementOpt'
+explore_seeds_default = '4'
+cached_backends = ['ecp5', 'ice40', 'gowin', 'openxc7']
+# caasw validate hands out configs to its worker processes in chunks of at least this many
+validate_chunk_size = 64
+
+TOOLS_DIR = os.path.join(Path(__file__).parent.absolute(), 'fpga_tools')
+
+# every placeholder known to the templates in fpga_tools/
+# longer names first, so a name is never matched by a prefix of itself
+CAAS_PLACEHOLDERS = sorted(['BACKEND', 'TOP', 'SOURCES', 'XDC', 'BITNAME', 'PART', 'FAMILY',
+                            'F4PGA_DEVICE', 'ECP5_PART', 'ECP5_PACKAGE',
+                            'ICE40_PART', 'ICE40_PACKAGE', 'GOWIN_PART', 'GOWIN_FAMILY',
+                            'SIM_TOP', 'SIM_SOURCES', 'SIM_MISC', 'SIM_VCD', 'SIM_THREADS',
+                            'EXPLORE_SEEDS', 'EXPLORE_DIRECTIVES', 'EXPLORE_JOBS'],
+                           key=len, reverse=True)
+CAAS_PLACEHOLDER_RE = re.compile('__CAAS_(' + '|'.join(CAAS_PLACEHOLDERS) + ')')
+
+# template path -> (mtime_ns, mode, tokens)
+_template_cache = {}
+
+# the field validators, compiled once as a bulk validate runs them for every config
+BASIC_FIELD_RE = re.compile(r'^[a-zA-Z0-9_-]+$')
+FILENAME_FIELD_RE = re.compile(r'^[a-zA-Z0-9_.-]+$')
+FILE_PATTERN_FIELD_RE = re.compile(r'^[a-zA-Z0-9_*,.\/-]+$')
+PART_FIELD_RE = re.compile(r'^[a-zA-Z0-9_\-/\\]+$')
+NUMBER_LIST_FIELD_RE = re.compile(r'^[0-9]+(\s*,\s*[0-9]+)*$')
+POSITIVE_INT_FIELD_RE = re.compile(r'^[1-9][0-9]*$')
+URL_FIELD_RE = re.compile(r'^[a-zA-Z0-9_\-.:/?=&]+$')
+
+# the part index: for every backend the tables of parts.json its parts are looked up in,
+# a table maps a device to the placeholder values it derives and the packages it comes in
+PARTS_FILE = os.path.join(TOOLS_DIR, 'parts.json')
+# how a part (lower case, sed-unescaped) splits into device and package, per table
+part_patterns = {'xc7': re.compile(r'^(xc7(?:s|a|k|v|vx|vh|z)\d+[ts]?)i?-?([a-z]+\d+)(?:-.*)?$'),
+                 'ultrascale': re.compile(r'^(xc(?:ku|vu|zu|au|k)\d+[a-z]*)-([a-z]+\d+)(?:-.*)?$'),
+                 'ecp5': re.compile(r'^(lfe5(?:u|um|um5g)-\d+f)-\d[a-z]+(\d+)[a-z]*$'),
+                 'ice40': re.compile(r'^ice40([a-z]+\d+k?)-([a-z]+\d+[a-z]*)$'),
+                 'gowin': re.compile(r'^(.+)()$')}
+# backend -> [(pattern, package placeholder, {device: entry})], see part_index()
+_part_index = None
 
 def validate_basic_field(value, field_name):
     """Validate fields that allow only alphanumeric, underscore, and minus sign"""
     if value is None:
         return True  # None values are handled by defaults
-    if not re.match(r'^[a-zA-Z0-9_-]+$', value):
+    if not BASIC_FIELD_RE.match(value):
         print(f'Error: {field_name} contains invalid characters. Only 0-9, a-z, A-Z, underscore, and minus sign are allowed.')
         print(f'Invalid value: {value}')
         return False
@@ -54,7 +212,7 @@ def validate_filename_field(value, field_name):
     """Validate fields that allow alphanumeric, underscore, minus sign, and period (for filenames)"""
     if value is None:
         return True  # None values are handled by defaults
-    if not re.match(r'^[a-zA-Z0-9_.-]+$', value):
+    if not FILENAME_FIELD_RE.match(value):
         print(f'Error: {field_name} contains invalid characters. Only 0-9, a-z, A-Z, underscore, minus sign, and period are allowed.')
         print(f'Invalid value: {value}')
         return False
@@ -64,7 +222,7 @@ def validate_file_pattern_field(value, field_name):
     """Validate fields that allow alphanumeric, underscore, minus sign, and asterisk"""
     if value is None or value == '':
         return True  # None/empty values are handled by defaults
-    if not re.match(r'^[a-zA-Z0-9_*,.\/-]+$', value):
+    if not FILE_PATTERN_FIELD_RE.match(value):
         print(f'Error: {field_name} contains invalid characters. Only 0-9, a-z, A-Z, underscore, minus sign, asterisk, comma, period, slash, and minus are allowed.')
         print(f'Invalid value: {value}')
         return False
@@ -75,25 +233,44 @@ def validate_part_field(value, field_name):
     if value is None:
         print(f'Error: {field_name} is required but not specified in configuration file.')
         return False
-    if not re.match(r'^[a-zA-Z0-9_\-/\\]+$', value):
+    if not PART_FIELD_RE.match(value):
         print(f'Error: {field_name} contains invalid characters. Only 0-9, a-z, A-Z, underscore, minus sign, slash, and backslash are allowed.')
         print(f'Invalid value: {value}')
         return False
     return True
 
+def validate_number_list_field(value, field_name):
+    """Validate a number or comma separated list of numbers"""
+    if not NUMBER_LIST_FIELD_RE.match(value):
+        print(f'Error: {field_name} must be a number or a comma separated list of numbers.')
+        print(f'Invalid value: {value}')
+        return False
+    return True
+
+def validate_positive_int_field(value, field_name):
+    """Validate a single positive integer, such as a count of jobs or threads"""
+    if not POSITIVE_INT_FIELD_RE.match(value):
+        print(f'Error: {field_name} must be a positive integer.')
+        print(f'Invalid value: {value}')
+        return False
+    return True
+
 def validate_url_field(value, field_name):
     """Validate URL fields (giturl) - basic validation for common URL characters"""
     if value is None or value == '':
         return True  # Optional field
     # Allow common URL characters: alphanumeric, underscore, minus, period, slash, colon, question mark, equals, ampersand
-    if not re.match(r'^[a-zA-Z0-9_\-.:/?=&]+$', value):
+    if not URL_FIELD_RE.match(value):
         print(f'Error: {field_name} contains invalid characters for a URL.')
         print(f'Invalid value: {value}')
         return False
     return True
 
-def validate_config_values(caas_conf, backend_override=None):
-    """Validate all configuration values for special characters"""
+def validate_config_values(caas_conf, backend_override=None, check_part=True, strict_part=False):
+    """Validate all configuration values for special characters.
+
+    With check_part, the part must also be known to the backend in the part index.
+    """
     valid = True
     
     # Get values from config
@@ -116,7 +293,19 @@ def validate_config_values(caas_conf, backend_override=None):
     valid &= validate_filename_field(gitconf, 'gitconf')
     
     # Validate part field (includes slash and backslash)
-    valid &= validate_part_field(part, 'part')
+    part_valid = validate_part_field(part, 'part')
+    valid &= part_valid
+
+    # Point out a part the backend's index doesn't know, its options are then derived from
+    # the name as before the index, strict_part (bulk validate) rejects it.
+    # With usegitconf the part comes from the cloned repo instead
+    usegitconf = caas_conf['project'].get('usegitconf') in ('true', 'True', '1')
+    if check_part and part_valid and backend and not usegitconf and part_info(backend, part) is None:
+        if strict_part:
+            print(f'Error: part {part} is not a known {backend} part, see {PARTS_FILE}.')
+            valid = False
+        else:
+            print(f'Warning: part {part} is not a known {backend} part, see {PARTS_FILE}.')
     
     # Validate file pattern fields (includes asterisk)
     valid &= validate_file_pattern_field(constraint, 'constraint')
@@ -132,33 +321,106 @@ def validate_config_values(caas_conf, backend_override=None):
         sim_sources = caas_conf['sim'].get('sources', sources)
         sim_misc = caas_conf['sim'].get('misc', misc)
         sim_vcd = caas_conf['sim'].get('vcd', waveform_default)
+        simulator = caas_conf['sim'].get('simulator', simulator_default)
+        sim_threads = caas_conf['sim'].get('threads', '1')
         
         valid &= validate_basic_field(sim_top, 'sim.top') if sim_top else True
         valid &= validate_file_pattern_field(sim_sources, 'sim.sources')
         valid &= validate_file_pattern_field(sim_misc, 'sim.misc')
         valid &= validate_file_pattern_field(sim_vcd, 'sim.vcd')
+        valid &= validate_positive_int_field(sim_threads, 'sim.threads')
+        if simulator not in simulators:
+            print(f'Error: sim.simulator must be one of {", ".join(simulators)}.')
+            print(f'Invalid value: {simulator}')
+            valid = False
     
+    # Validate exploration fields if present
+    if 'explore' in caas_conf:
+        seeds = caas_conf['explore'].get('seeds', explore_seeds_default)
+        directives = caas_conf['explore'].get('directives', explore_directives_default)
+        jobs = caas_conf['explore'].get('jobs', '1')
+
+        valid &= validate_number_list_field(seeds, 'explore.seeds')
+        valid &= validate_positive_int_field(jobs, 'explore.jobs')
+        for d in directives.split(','):
+            valid &= validate_basic_field(d.strip(), 'explore.directives')
+
     return valid
 
+def part_index():
+    """Load fpga_tools/parts.json once into dicts, so a part is found with one lookup per table"""
+    global _part_index
+    if _part_index is None:
+        with open(PARTS_FILE) as f:
+            data = json.load(f)
+        tables = {}
+        for name, table in data['tables'].items():
+            devices = {}
+            for device, entry in table['devices'].items():
+                entry = dict(entry)
+                if isinstance(entry.get('packages'), list):
+                    entry['packages'] = frozenset(entry['packages'])
+                devices[device.lower()] = entry
+            tables[name] = (part_patterns[name], table['package_field'], devices)
+        _part_index = {backend: [tables[t] for t in names] for backend, names in data['backends'].items()}
+    return _part_index
+
+def part_info(backend, part):
+    """Placeholder values derived from part for backend, looked up in the part index.
+
+    The device the part was matched to is under 'device'. Returns {} for a backend
+    without an index and None for a part the index doesn't know.
+    """
+    tables = part_index().get(backend)
+    if tables is None:
+        return {}
+    # configs written for the sed era may escape the slash of gowin parts
+    key = sed_unescape(part).lower()
+    for pattern, package_field, devices in tables:
+        m = pattern.match(key)
+        entry = devices.get(m.group(1)) if m else None
+        if entry is None:
+            continue
+        package = m.group(2)
+        packages = entry.get('packages')
+        if packages is not None and package not in packages:
+            continue
+        info = {k: v for k, v in entry.items() if k != 'packages'}
+        info['device'] = m.group(1)
+        if package_field:
+            info[package_field] = packages[package] if isinstance(packages, dict) else package
+        return info
+    return None
+
+# The *_derive helpers look a part up in the index, a part it doesn't know is derived
+# from its name, with the rules used before the index
+
 def xc7family_derive(part, backend):
-    family = ''
-    if 'xc7s' in part:
-        family = 'spartan7'
-    elif 'xc7a' in part:
-        family = 'artix7'
-    elif 'xc7k' in part:
-        family = 'kintex7'
-    elif 'xc7v' in part:
-        family = 'virtex7'
-    elif 'xc7z' in part:
-        family = 'zynq7'
+    info = part_info(backend, part)
+    if info is not None:
+        family = info.get('FAMILY', '')
+    else:
+        family = ''
+        if 'xc7s' in part:
+            family = 'spartan7'
+        elif 'xc7a' in part:
+            family = 'artix7'
+        elif 'xc7k' in part:
+            family = 'kintex7'
+        elif 'xc7v' in part:
+            family = 'virtex7'
+        elif 'xc7z' in part:
+            family = 'zynq7'
     print("7-series FPGA family derived to be " + family)
     return family
 
 def f4pga_device_derive(part, backend):
     f4pga_device = ''
     if backend == 'f4pga':
-        if 'xc7z' in part:
+        info = part_info(backend, part)
+        if info is not None:
+            f4pga_device = info['device'] + '_test'
+        elif 'xc7z' in part:
             f4pga_device = part[:7] + '_test' # now seems xc7z010 only
         else:
             f4pga_device = part[:part.find('t')+1] + '_test'
@@ -166,69 +428,128 @@ def f4pga_device_derive(part, backend):
     return f4pga_device
 
 def ecp5_derive(part, backend):
+    info = part_info(backend, part)
+    if info is not None:
+        return (info.get('ECP5_PART', ''), info.get('ECP5_PACKAGE', ''))
     ecp5_part = ''
     ecp5_package = ''
     if backend == 'ecp5' and 'lfe5' in part:
         prefix = 'um5g-' if 'um5g' in part else 'um-' if 'um' in part else ''
         size = ''
-        if '12f' in part:
-            size = '12k'
-        elif '25f' in part:
-            size = '25k'
-        elif '45f' in part:
-            size = '45k'
-        elif '85f' in part:
-            size = '85k'
+        for f, k in (('12f', '12k'), ('25f', '25k'), ('45f', '45k'), ('85f', '85k')):
+            if f in part:
+                size = k
+                break
         ecp5_part = prefix + size
-        if '256' in part:
-            ecp5_package = 'CABGA256'
-        elif '285' in part:
-            ecp5_package = 'CSFBGA285'
-        elif '381' in part:
-            ecp5_package = 'CABGA381'
-        elif '554' in part:
-            ecp5_package = 'CABGA554'
-        elif '756' in part:
-            ecp5_package = 'CABGA756'
-        elif '144' in part:
-            ecp5_package = 'TQFP144'
+        for n, name in (('256', 'CABGA256'), ('285', 'CSFBGA285'), ('381', 'CABGA381'),
+                        ('554', 'CABGA554'), ('756', 'CABGA756'), ('144', 'TQFP144')):
+            if n in part:
+                ecp5_package = name
+                break
     return (ecp5_part, ecp5_package)
 
 def ice40_derive(part, backend):
+    info = part_info(backend, part)
+    if info is not None:
+        return (info.get('ICE40_PART', ''), info.get('ICE40_PACKAGE', ''))
     ice40_part = ''
     ice40_package = ''
     if backend == 'ice40' and 'ice40' in part:
         ice40_part = part[5:part.find('-')]
-        if ice40_part[0] == 'p':
-            ice40_part[0] = 'u'
+        if ice40_part[:1] == 'p':
+            ice40_part = 'u' + ice40_part[1:]
         ice40_package = part[part.find('-')+1:]
     return (ice40_part, ice40_package)
 
 def gowin_derive(part, backend):
-    gowin_part = ''
-    gowin_family = ''
-    if backend == 'gowin' and 'GW' in part:
-        gowin_part = part
-        # parts in https://github.com/YosysHQ/apicula/blob/master/examples/Makefile
-        if part == 'GW1NR-LV9QN88PC6\/I5':
-            gowin_family = 'GW1N-9C'
-        elif part == 'GW1NSR-LV4CQN48PC7\/I6':
-            gowin_family = 'GW1NS-4'
-        elif part == 'GW1NZ-LV1QN48C6\/I5':
-            gowin_family = 'GW1NZ-1'
-        elif part == 'GW1NR-LV9QN88C6\/I5':
-            gowin_family = 'GW1N-9'
-        elif part == 'GW2AR-LV18QN88C8\/I7':
-            gowin_family = 'GW2A-18C'
-        elif part == 'GW2A-LV18PG256C8\/I7':
-            gowin_family = 'GW2A-18'
-        elif part == 'GW1N-UV4LQ144C6\/I5':
-            gowin_family = 'GW1N-4'
-        elif part == 'GW1N-LV1QN48C6\/I5':
-            gowin_family = 'GW1N-1'
-        elif part == 'GW1NS-UX2CQN48C5\/I4':
-            gowin_family = 'GW1NS-2'
-    return (gowin_part, gowin_family)
+    info = part_info(backend, part)
+    if info is not None:
+        return (part, info.get('GOWIN_FAMILY', ''))
+    # the part is passed on as is, without a family
+    return (part if backend == 'gowin' and 'GW' in part else '', '')
+
+def explore_derive(caas_conf, backend):
+    """(seeds, Vivado directives, parallel runs) of an [explore] sweep, empty strings without one.
+
+    seeds = N sweeps seeds 1 to N, a comma separated list sweeps those seeds.
+    """
+    if 'explore' not in caas_conf:
+        return ('', '', '1')
+    explore = caas_conf['explore']
+    seeds = ''
+    directives = ''
+    if backend == 'vivado':
+        runs = [d.strip() for d in explore.get('directives', explore_directives_default).split(',') if d.strip()]
+        directives = ' '.join(runs)
+    else:
+        value = explore.get('seeds', explore_seeds_default)
+        if ',' in value:
+            runs = [v.strip() for v in value.split(',')]
+        else:
+            runs = [str(i) for i in range(1, int(value) + 1)]
+        seeds = ' '.join(runs)
+    jobs = explore.get('jobs', str(min(len(runs), 4)))
+    print('Explore %d place-and-route runs, %s at a time' % (len(runs), jobs))
+    return (seeds, directives, jobs)
+
+def sim_wave_name(caas_conf):
+    """File name of the waveform a simulation writes to the build directory"""
+    sim_conf = caas_conf['sim'] if 'sim' in caas_conf else {}
+    vcd = sim_conf.get('vcd', waveform_default)
+    if sim_conf.get('simulator', simulator_default) == 'verilator':
+        return os.path.splitext(vcd)[0] + '.fst'
+    return vcd
+
+def sim_result_artifacts(caas_conf):
+    """result_artifacts of a simulation job"""
+    return [('log', result_log_name, 'Log', False),
+            ('simlog', result_sim_log_name, 'Simulation log', False),
+            ('wave', sim_wave_name(caas_conf), 'Waveform', True)]
+
+def both_result_artifacts(caas_conf):
+    """result_artifacts of a combined compilation and simulation job"""
+    return result_artifacts + sim_result_artifacts(caas_conf)[1:]
+
+def payload_artifacts(payload):
+    """Artifacts to download for a job prepared by package(), None for the defaults"""
+    if payload.get('both'):
+        return both_result_artifacts(payload['conf'])
+    if payload.get('sim'):
+        return sim_result_artifacts(payload['conf'])
+    return None
+
+def sed_unescape(value):
+    """Undo the sed-style escaping that was required when templates were patched by sed"""
+    # configs written for the sed era may contain e.g. GW1NR-LV9QN88PC6\/I5
+    return value.replace('\\/', '/')
+
+def load_template(path):
+    """Load a template and split it into (literal, placeholder) pairs, cached per path"""
+    st = os.stat(path)
+    cached = _template_cache.get(path)
+    if cached and cached[0] == st.st_mtime_ns:
+        return cached
+    with open(path) as f:
+        parts = CAAS_PLACEHOLDER_RE.split(f.read())
+    # re.split with a group alternates literal text and placeholder names
+    parts.append(None)
+    tokens = tuple(zip(parts[0::2], parts[1::2]))
+    cached = (st.st_mtime_ns, st.st_mode & 0o777, tokens)
+    _template_cache[path] = cached
+    return cached
+
+def render_template(template, dest, values):
+    """Render a template to dest in one pass, substituting __CAAS_* placeholders from values"""
+    _, mode, tokens = load_template(template)
+    out = []
+    for literal, name in tokens:
+        out.append(literal)
+        if name is not None:
+            out.append(values[name])
+    with open(dest, 'w') as f:
+        f.write(''.join(out))
+    os.chmod(dest, mode)
+    print("'%s' -> '%s'" % (template, dest))
 
 def getjobid():
     return '%08x' % random.randrange(16**8)
@@ -249,23 +570,111 @@ def extract_github_url(url):
     else:
         return (-1, -1, -1, -1)
 
+def run_git(args):
+    print('Run git ' + ' '.join(args))
+    return subprocess.run(['git'] + args, env=dict(os.environ, GIT_TERMINAL_PROMPT='0')).returncode
+
+def git_mirror_path(mirror_root, url):
+    """Bare mirror directory of a repository URL"""
+    name = url.rstrip('/').split('/')[-1]
+    if name.endswith('.git'):
+        name = name[:-4]
+    return os.path.join(mirror_root, hashlib.sha256(url.encode()).hexdigest()[:16] + '-' + name + '.git')
+
+def git_mirror_update(mirror_root, url, max_age=None):
+    """Create the bare mirror of url or fetch it if stale, return its path, None if unusable.
+
+    Updates hold an exclusive lock on the mirror, clones from it a shared one.
+    """
+    if max_age is None:
+        max_age = git_mirror_max_age
+    os.makedirs(mirror_root, exist_ok=True)
+    mirror = git_mirror_path(mirror_root, url)
+    stamp = mirror + '.fetched'
+    with open(mirror + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.isdir(mirror):
+            tmp = mirror + '.tmp'
+            shutil.rmtree(tmp, ignore_errors=True)
+            # job clones borrow objects from the mirror, it must never prune them
+            if run_git(['clone', '--mirror', url, tmp]) or run_git(['--git-dir', tmp, 'config', 'gc.pruneExpire', 'never']):
+                shutil.rmtree(tmp, ignore_errors=True)
+                return None
+            os.rename(tmp, mirror)
+        elif not os.path.exists(stamp) or time.time() - os.path.getmtime(stamp) > max_age:
+            if run_git(['--git-dir', mirror, 'fetch', '--prune', 'origin']):
+                print('Fetch failed, using the mirror as of its last fetch.')
+                return mirror
+        else:
+            return mirror
+        Path(stamp).touch()
+    return mirror
+
+def git_mirror_refresh(mirror_root):
+    """Fetch every mirror under mirror_root, return the number of failed fetches"""
+    failed = 0
+    for mirror in sorted(glob.glob(os.path.join(mirror_root, '*.git'))):
+        with open(mirror + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if run_git(['--git-dir', mirror, 'fetch', '--prune', 'origin']):
+                failed = failed + 1
+            else:
+                Path(mirror + '.fetched').touch()
+    return failed
+
 def git_clone(url, branch, dir):
+    mirror_root = os.environ.get(git_mirror_env)
+    mirror = git_mirror_update(mirror_root, url) if mirror_root else None
+    if mirror is not None:
+        with open(mirror + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            ret = run_git(['clone', '--shared', '--single-branch'] + (['-b', branch] if branch else []) + [mirror, dir])
+        if ret == 0:
+            return run_git(['-C', dir, 'remote', 'set-url', 'origin', url])
+        print('Clone from mirror failed, clone from %s instead.' % url)
+        shutil.rmtree(dir, ignore_errors=True)
     cmd = "GIT_TERMINAL_PROMPT=0 git clone --depth=1 " + (("-b " + branch) if branch else "") + " " + url + " " + dir
     print('Run ' + cmd)
     return os.system(cmd)
 
-# this runs on the compiling server, caasw submit doesn't need this
-def mfgen(conf_file, proj_dir, makefile, script, backend, overwrite, clone, sim=False):
-    if overwrite == False and (os.path.isfile(script) or os.path.isfile(makefile)):
-        print('File exist! Use --overwrite to overwrite')
-        sys.exit(1)
+class CaasError(Exception):
+    """Raised by the library API when a project cannot be prepared"""
+    pass
+
+def load_conf(config):
+    """Accept a caas.conf path or an already parsed ConfigParser"""
+    if isinstance(config, configparser.ConfigParser):
+        return config
+    if not os.path.isfile(config):
+        raise CaasError('Configuration file %s not found!' % config)
     caas_conf = configparser.ConfigParser()
-    caas_conf.read(conf_file)
+    caas_conf.read(config)
+    if 'project' not in caas_conf:
+        raise CaasError('Configuration file %s has no [project] section!' % config)
+    return caas_conf
+
+# this runs on the compiling server, caasw submit doesn't need this
+def generate(config, proj_dir='.', makefile=None, script=None, backend=None, overwrite=False, clone=False, sim=False, both=False):
+    """Generate Makefile and script for a project, return a dict describing the result.
+
+    config is a caas.conf path or a ConfigParser. With both, compilation and simulation
+    run in one job, sim is ignored then. Raises CaasError on failure.
+    """
+    if both:
+        sim = False
+    if makefile is None:
+        makefile = GENERIC_BOTH_MF_NAME if both else GENERIC_SIM_MF_NAME if sim else GENERIC_MF_NAME
+    if script is None:
+        script = GENERIC_BOTH_SH_NAME if both else GENERIC_SIM_SH_NAME if sim else GENERIC_SH_NAME
+    if not os.path.exists(proj_dir):
+        raise CaasError('Project directory %s not found!' % proj_dir)
+    if overwrite == False and (os.path.isfile(os.path.join(proj_dir, script)) or os.path.isfile(os.path.join(proj_dir, makefile))):
+        raise CaasError('File exist! Use --overwrite to overwrite')
+    caas_conf = load_conf(config)
 
     # Validate configuration values for special characters
-    if not validate_config_values(caas_conf, backend):
-        print('Configuration input validation failed! Please fix the invalid characters in your configuration file.')
-        sys.exit(1)
+    if not validate_config_values(caas_conf, backend, check_part=not sim):
+        raise CaasError('Configuration input validation failed! Please fix the invalid values in your configuration file.')
 
     backend = caas_conf['project'].get('backend') if backend == None else backend
     part = caas_conf['project'].get('part')
@@ -284,40 +693,41 @@ def mfgen(conf_file, proj_dir, makefile, script, backend, overwrite, clone, sim=
         sim_sources = caas_conf['sim'].get('sources', sources)
         sim_misc = caas_conf['sim'].get('misc', misc)
         sim_vcd = caas_conf['sim'].get('vcd', waveform_default)
+        simulator = caas_conf['sim'].get('simulator', simulator_default)
+        sim_threads = caas_conf['sim'].get('threads', '')
     else:
         sim_top = simtop_default
         sim_sources = sources
         sim_misc = misc
         sim_vcd = waveform_default
+        simulator = simulator_default
+        sim_threads = ''
     # Valid URL examples: 
     # https://github.com/FPGAOL-CE/user-examples
     # https://github.com/FPGAOL-CE/user-examples/tree/main/tangnano9k
 
     # Clone a Git URL and compile. No matter the compilation details are specified
     # in this caas_conf or in the repo itself, we always generate a new .caas.conf
-    # in the cloned repo specified directory DIR, run caasw mfgen in DIR, and
+    # in the cloned repo specified directory DIR, run generate() in DIR, and
     # generate a dummy makefile that call make in DIR and copy/move back built
     # results from DIR. 
     if giturl:
         cloneurl, branch, path, reponame = extract_github_url(giturl)
+        if cloneurl == -1:
+            raise CaasError('Misformed URL: %s, only GitHub URL supported now!' % giturl)
         localdir = os.path.join(proj_dir, reponame)
         # this rel_path is valid in docker, which is important
         target_rel_path = os.path.join(reponame, path)
         target_proj_dir = os.path.join(localdir, path)
-        if cloneurl == -1:
-            print('Misformed URL: %s, only GitHub URL supported now!' % giturl)
-            sys.exit(1)
         print('Git URL specified, repo: %s, branch: %s, path in repo: %s ' % (cloneurl, branch, path))
         if os.path.exists(localdir):
             print('Git repo already exists locally, skip cloning.')
         elif not clone:
-            print('Git repo does\'t exist locally, --clone is required for cloning Git URL!')
-            sys.exit(1)
+            raise CaasError('Git repo does\'t exist locally, --clone is required for cloning Git URL!')
         else:
             print('Clone the repo to %s...' % localdir)
             if git_clone(cloneurl, branch, localdir):
-                print('Clone failed!')
-                sys.exit(1)
+                raise CaasError('Clone failed!')
 
         if usegitconf == 'true' or usegitconf == 'True' or usegitconf == '1':
             print('Use specified config(%s) in repo.' % gitconf)
@@ -337,40 +747,53 @@ def mfgen(conf_file, proj_dir, makefile, script, backend, overwrite, clone, sim=
             with open(os.path.join(target_proj_dir, gitconf), 'w') as f:
                 gen_conf.write(f)
                 print('%s writen to %s/' % (gitconf, target_proj_dir))
-        # call caasw in target directory for real Makefile gen
+        # generate the real Makefile in target directory
         print('Call caas-wizard in %s...' % target_proj_dir)
-        # We recommended run caasw in current directory, though in principle
-        # specifying any directory will work
-        sim_flag = " --sim" if sim else ""
-        cmd = "cd " + target_proj_dir + " && " + sys.argv[0] + " --overwrite" + sim_flag + " mfgen ./%s ." % gitconf
         print('------------')
-        if os.system(cmd):
-            print('Call caas-wizard error!')
-            sys.exit(1)
+        try:
+            inner = generate(os.path.join(target_proj_dir, gitconf), target_proj_dir, overwrite=True, sim=sim, both=both)
+        except CaasError as e:
+            raise CaasError('Call caas-wizard error! ' + str(e))
         print('------------')
         # finally, generate dummy script based on mode
-        script_name = GENERIC_SIM_SH_NAME if sim else GENERIC_SH_NAME
+        script_name = GENERIC_BOTH_SH_NAME if both else GENERIC_SIM_SH_NAME if sim else GENERIC_SH_NAME
         print('Write dummy %s...' % script_name)
-        os.system('''cat > %s << EOF
-#!/bin/sh
-curdir=\`pwd\`
-cd \$curdir/%s
+        dummy = os.path.join(proj_dir, script_name)
+        with open(dummy, 'w') as f:
+            f.write('''#!/bin/sh
+curdir=`pwd`
+cd $curdir/%s
 ./%s
-ret=\$?
-cd \$curdir
+ret=$?
+cd $curdir
 mkdir -p %s
-cp -rf \$curdir/%s/%s/* \$curdir/%s/
-exit \$ret
-EOF
-''' % (os.path.join(proj_dir, script_name),
-     target_rel_path,
+cp -rf $curdir/%s/%s/* $curdir/%s/
+exit $ret
+''' % (target_rel_path,
      script_name,
      result_dir,
      target_rel_path, result_dir, result_dir))
-        os.system('chmod +x %s' % os.path.join(proj_dir, script_name))
-        mode_str = "simulation" if sim else "compilation"
+        os.chmod(dummy, 0o755)
+        mode_str = "compilation and simulation" if both else "simulation" if sim else "compilation"
         print('Done preperation for Git URL %s.' % mode_str)
-        sys.exit(0)
+        return {'proj_dir': proj_dir, 'backend': inner['backend'], 'part': inner['part'], 'sim': sim, 'both': both,
+                'makefile': inner['makefile'], 'script': dummy, 'giturl': giturl, 'target_dir': target_proj_dir}
+
+    # compilation and simulation in one job: render both Makefiles as usual, and
+    # Makefile.both that runs them as two branches of one make -j in one container
+    if both:
+        if backend not in combined_backends:
+            raise CaasError('Backend %s has no simulators in its image, submit compilation and simulation as two jobs!' % backend)
+        generate(caas_conf, proj_dir, backend=backend, overwrite=overwrite)
+        generate(caas_conf, proj_dir, backend=backend, overwrite=overwrite, sim=True)
+        print("Using combined mode - rendering Makefile.both and run_both.sh templates")
+        mf = os.path.join(proj_dir, makefile)
+        sh = os.path.join(proj_dir, script)
+        values = {'BACKEND': backend, 'PART': sed_unescape(part)}
+        render_template(os.path.join(TOOLS_DIR, 'Makefile.both'), mf, values)
+        render_template(os.path.join(TOOLS_DIR, 'run_both.sh'), sh, values)
+        return {'proj_dir': proj_dir, 'backend': backend, 'part': part, 'sim': sim, 'both': both,
+                'makefile': mf, 'script': sh, 'giturl': None, 'target_dir': proj_dir}
 
     # We don't need to cover all cases, "bad" cases just return empty
 
@@ -389,93 +812,614 @@ EOF
     # deriving gowin compilation options
     gowin_part, gowin_family = gowin_derive(part, backend)
 
-    # copy the template files
-    print("Copy build files...")
-    tools_dir = os.path.join(Path(__file__).parent.absolute(), 'fpga_tools')
+    # deriving place-and-route exploration, not for simulation
+    explore_seeds, explore_directives, explore_jobs = explore_derive(caas_conf, backend) if not sim else ('', '', '1')
+
+    # render the template files
+    print("Render build files...")
     
     # Choose the appropriate Makefile and shell script templates based on simulation mode
     if sim:
-        mf_t = os.path.join(tools_dir, 'Makefile.sim')
-        sh_t = os.path.join(tools_dir, 'run_sim.sh')
-        print("Using simulation mode - copying Makefile.sim and run_sim.sh templates")
+        mf_name = 'Makefile.sim' if simulator == 'icarus' else 'Makefile.sim.' + simulator
+        mf_t = os.path.join(TOOLS_DIR, mf_name)
+        sh_t = os.path.join(TOOLS_DIR, 'run_sim.sh')
+        print("Using simulation mode - rendering " + mf_name + " and run_sim.sh templates")
     else:
-        mf_t = os.path.join(tools_dir, 'Makefile.' + backend)
-        sh_t = os.path.join(tools_dir, backend + '.sh')
-        print("Using compilation mode - copying Makefile." + backend + " and " + backend + ".sh templates")
+        mf_t = os.path.join(TOOLS_DIR, 'Makefile.' + backend)
+        sh_t = os.path.join(TOOLS_DIR, backend + '.sh')
+        print("Using compilation mode - rendering Makefile." + backend + " and " + backend + ".sh templates")
+    if not (os.path.isfile(mf_t) and os.path.isfile(sh_t)):
+        raise CaasError('Error copying Makefile! Backend doesn\'t exist!')
     
     mf = os.path.join(proj_dir, makefile)
     sh = os.path.join(proj_dir, script)
-    if os.system("cp -v " + mf_t + " " + mf) + \
-            os.system("cp -v " + sh_t + " " + sh) != 0:
-        print('Error copying Makefile! Backend doesn\'t exist!')
-        sys.exit(-1)
 
-    print("Patching build files...")
     # only vivado backend is tcl-based, others are just makefiles
     srcwildcard = ""
     if backend != 'vivado':
-        for s in sources.replace("/", "\/").split(","):
+        for s in sources.split(","):
             srcwildcard = srcwildcard + " $(wildcard " + s + ") "
     else:
-        srcwildcard = sources.replace("/", "\/").replace(",", " ")
+        srcwildcard = sources.replace(",", " ")
     constraintwildcard = ""
-    for s in constraint.replace("/", "\/").split(","):
+    for s in constraint.split(","):
         constraintwildcard = constraintwildcard + " $(wildcard " + s + ") "
     # simulation-specific wildcards
     sim_srcwildcard = ""
-    for s in sim_sources.replace("/", "\/").split(","):
+    for s in sim_sources.split(","):
         sim_srcwildcard = sim_srcwildcard + " $(wildcard " + s + ") "
     sim_miscwildcard = ""
-    for s in sim_misc.replace("/", "\/").split(","):
+    for s in sim_misc.split(","):
         sim_miscwildcard = sim_miscwildcard + " $(wildcard " + s + ") "
-    os.system(SEDEXEC + " -i " 
-              + "-e \'s/__CAAS_TOP/" + top + "/g\' "
-              + "-e \'s/__CAAS_SOURCES/" + srcwildcard + "/g\' "
-              + "-e \'s/__CAAS_XDC/" + constraintwildcard + "/g\' "
-              + "-e \'s/__CAAS_BITNAME/" + bitname + "/g\' "
-              + "-e \'s/__CAAS_PART/" + part + "/g\' "
-              + "-e \'s/__CAAS_FAMILY/" + xc7family + "/g\' "
-              + "-e \'s/__CAAS_F4PGA_DEVICE/" + f4pga_device + "/g\' "
-              + "-e \'s/__CAAS_ECP5_PART/" + ecp5_part + "/g\' "
-              + "-e \'s/__CAAS_ECP5_PACKAGE/" + ecp5_package + "/g\' "
-              + "-e \'s/__CAAS_ICE40_PART/" + ice40_part + "/g\' "
-              + "-e \'s/__CAAS_ICE40_PACKAGE/" + ice40_package + "/g\' "
-              + "-e \'s/__CAAS_GOWIN_PART/" + gowin_part + "/g\' "
-              + "-e \'s/__CAAS_GOWIN_FAMILY/" + gowin_family + "/g\' "
-              + "-e \'s/__CAAS_SIM_TOP/" + sim_top + "/g\' "
-              + "-e \'s/__CAAS_SIM_SOURCES/" + sim_srcwildcard + "/g\' "
-              + "-e \'s/__CAAS_SIM_MISC/" + sim_miscwildcard + "/g\' "
-              + "-e \'s/__CAAS_SIM_VCD/" + sim_vcd + "/g\' "
-              + mf)
+    values = {
+        'BACKEND': backend,
+        'TOP': top,
+        'SOURCES': srcwildcard,
+        'XDC': constraintwildcard,
+        'BITNAME': bitname,
+        'PART': sed_unescape(part),
+        'FAMILY': xc7family,
+        'F4PGA_DEVICE': f4pga_device,
+        'ECP5_PART': ecp5_part,
+        'ECP5_PACKAGE': ecp5_package,
+        'ICE40_PART': ice40_part,
+        'ICE40_PACKAGE': ice40_package,
+        'GOWIN_PART': sed_unescape(gowin_part),
+        'GOWIN_FAMILY': gowin_family,
+        'SIM_TOP': sim_top,
+        'SIM_SOURCES': sim_srcwildcard,
+        'SIM_MISC': sim_miscwildcard,
+        'SIM_VCD': sim_vcd,
+        'SIM_THREADS': sim_threads,
+        'EXPLORE_SEEDS': explore_seeds,
+        'EXPLORE_DIRECTIVES': explore_directives,
+        'EXPLORE_JOBS': explore_jobs,
+    }
+    render_template(mf_t, mf, values)
+    render_template(sh_t, sh, values)
+    render_template(os.path.join(TOOLS_DIR, STAGE_SH_NAME), os.path.join(proj_dir, STAGE_SH_NAME), values)
+    if not sim:
+        render_template(os.path.join(TOOLS_DIR, EXPLORE_SH_NAME), os.path.join(proj_dir, EXPLORE_SH_NAME), values)
+    if (not sim and backend in cached_backends) or (sim and simulator == 'verilator'):
+        render_template(os.path.join(TOOLS_DIR, CACHE_SH_NAME), os.path.join(proj_dir, CACHE_SH_NAME), values)
+    return {'proj_dir': proj_dir, 'backend': backend, 'part': part, 'sim': sim, 'both': both,
+            'makefile': mf, 'script': sh, 'giturl': None, 'target_dir': proj_dir}
 
-def requestexp(e):
-    print("Exception occured when communicating with server: ", e)
+def mfgen(conf_file, proj_dir, makefile, script, backend, overwrite, clone, sim=False, both=False):
+    """Command line wrapper of generate()"""
+    try:
+        generate(conf_file, proj_dir, makefile, script, backend, overwrite, clone, sim, both)
+    except CaasError as e:
+        print(e)
+        sys.exit(1)
 
-# only do upload and query. mfgen, etc are done by server's caasw
-def submit(conf_file, proj_dir, dryrun, newjobid):
-    import requests
-    print(term_white + "Preparing payload for project..." + term_orig)
-    caas_conf = configparser.ConfigParser()
-    caas_conf.read(conf_file)
-    
-    # Validate configuration values for special characters
-    # This is "frontend", but server will do a validation on the backend nonetheless
-    if not validate_config_values(caas_conf):
-        print('Configuration input validation failed! Please fix the invalid characters in your configuration file.')
+def expand_projects(spec):
+    """Expand a manifest file (one directory or glob per line) or a glob into project directories"""
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            patterns = [l.strip() for l in f if l.strip() and not l.strip().startswith('#')]
+    else:
+        patterns = [spec]
+    proj_dirs = []
+    seen = set()
+    for pattern in patterns:
+        for d in sorted(glob.glob(pattern)):
+            if d not in seen and os.path.isdir(d):
+                seen.add(d)
+                proj_dirs.append(d)
+    return proj_dirs
+
+def _generate_one(proj_dir, conf_name, kwargs):
+    """Run generate() for one project of a batch, never raise"""
+    log = io.StringIO()
+    start = time.time()
+    try:
+        with contextlib.redirect_stdout(log):
+            result = generate(os.path.join(proj_dir, conf_name), proj_dir, **kwargs)
+        return {'dir': proj_dir, 'ok': True, 'backend': result['backend'], 'part': result['part'],
+                'makefile': result['makefile'], 'script': result['script'],
+                'seconds': round(time.time() - start, 4)}
+    # one bad config must not abort the others, so catch everything here
+    except Exception as e:
+        return {'dir': proj_dir, 'ok': False, 'error': '%s: %s' % (type(e).__name__, e),
+                'log': log.getvalue(), 'seconds': round(time.time() - start, 4)}
+
+def generate_batch(proj_dirs, workers=None, conf_name=caas_conf_default, **kwargs):
+    """Run generate() for many projects on a process pool, return one result dict per project in order.
+
+    Every project reads its own conf_name, other keyword arguments are passed to generate().
+    """
+    if workers == 1 or len(proj_dirs) <= 1:
+        return [_generate_one(d, conf_name, kwargs) for d in proj_dirs]
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(_generate_one, d, conf_name, kwargs) for d in proj_dirs]
+        for d, fut in zip(proj_dirs, futures):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                # the worker process itself died
+                results.append({'dir': d, 'ok': False, 'error': '%s: %s' % (type(e).__name__, e)})
+    return results
+
+def mfgen_batch(spec, workers, makefile, script, backend, overwrite, clone, sim=False, both=False):
+    """Command line wrapper of generate_batch(), print a JSON summary"""
+    proj_dirs = expand_projects(spec)
+    if not proj_dirs:
+        print('No project directory matches %s!' % spec)
         sys.exit(1)
-    
-    constraint = caas_conf['project'].get('constraint', constraint_default)
-    sources = caas_conf['project'].get('sources', sources_default)
-    misc = caas_conf['project'].get('misc', misc_default)
-    print("Copy config file...")
-    os.system("cp -v " + conf_file + ' ' + os.path.join(proj_dir, caas_armed_file))
-    print("Archive project...")
-    ret = os.system('cd ' + proj_dir + ' && \
-            zip -FSr ' + upload_file + ' ' + \
-            caas_armed_file + ' ' + constraint.replace(",", " ") + ' ' + sources.replace(",", " ") + ' ' + misc.replace(",", " "))
-    if ret != 0:
-        print("Error archiving project!")
+    start = time.time()
+    results = generate_batch(proj_dirs, workers, makefile=makefile, script=script, backend=backend,
+                             overwrite=overwrite, clone=clone, sim=sim, both=both)
+    failed = sum(1 for r in results if not r['ok'])
+    print(json.dumps({'total': len(results), 'succeeded': len(results) - failed, 'failed': failed,
+                      'seconds': round(time.time() - start, 4), 'projects': results}, indent=2))
+    if failed:
         sys.exit(1)
+
+def _validate_chunk(confs, backend, sim):
+    """Validate the configs of one chunk of a bulk validate, never raise"""
+    results = []
+    for conf in confs:
+        log = io.StringIO()
+        result = {'conf': conf, 'ok': False}
+        try:
+            with contextlib.redirect_stdout(log):
+                caas_conf = load_conf(conf)
+                result['ok'] = validate_config_values(caas_conf, backend, check_part=not sim, strict_part=True)
+            result['backend'] = backend or caas_conf['project'].get('backend')
+            result['part'] = caas_conf['project'].get('part')
+        # a broken file must not abort the others, so catch everything here
+        except Exception as e:
+            print('%s: %s' % (type(e).__name__, e), file=log)
+        if not result['ok']:
+            result['errors'] = log.getvalue().splitlines()
+        results.append(result)
+    return results
+
+def validate_batch(confs, workers=None, backend=None, sim=False):
+    """Validate many caas.conf files on a process pool, return one result dict per file in order.
+
+    Files are handed out in chunks, a config takes far less time to check than to ship
+    to a worker. With sim, parts are not checked against the part index.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(confs) <= validate_chunk_size:
+        return _validate_chunk(confs, backend, sim)
+    chunk = max(validate_chunk_size, -(-len(confs) // (workers * 4)))
+    chunks = [confs[i:i + chunk] for i in range(0, len(confs), chunk)]
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        for chunk_results in ex.map(_validate_chunk, chunks, [backend] * len(chunks), [sim] * len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+def validate_cli(spec, workers, backend, sim=False):
+    """Command line wrapper of validate_batch(), print a JSON summary of the invalid configs.
+
+    spec is a caas.conf file, or a manifest or glob of project directories.
+    """
+    if spec.endswith('.conf') and os.path.isfile(spec):
+        confs = [spec]
+    else:
+        confs = [os.path.join(d, caas_conf_default) for d in expand_projects(spec)]
+    if not confs:
+        print('No project directory matches %s!' % spec)
+        sys.exit(1)
+    start = time.time()
+    results = validate_batch(confs, workers, backend, sim)
+    invalid = [r for r in results if not r['ok']]
+    print(json.dumps({'total': len(results), 'valid': len(results) - len(invalid), 'invalid': len(invalid),
+                      'seconds': round(time.time() - start, 4), 'projects': invalid}, indent=2))
+    if invalid:
+        sys.exit(1)
+
+def _warm_one(part):
+    """Build the openxc7 chip database of one part through a throwaway project"""
+    start = time.time()
+    with tempfile.TemporaryDirectory(prefix='caas_chipdb_') as tmp:
+        caas_conf = configparser.ConfigParser()
+        caas_conf['project'] = {'backend': 'openxc7', 'part': part}
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                result = generate(caas_conf, tmp, overwrite=True)
+        except CaasError as e:
+            return {'part': part, 'ok': False, 'error': str(e)}
+        # run_caas.sh passes its arguments to make, only the chip database target is built
+        ret = subprocess.run([result['script'], 'chipdb'], cwd=tmp).returncode
+    return {'part': part, 'ok': ret == 0, 'seconds': round(time.time() - start, 2)}
+
+def chipdb_warm(parts, workers=1):
+    """Pre-build openxc7 chip databases for parts into the shared cache, return one result per part.
+
+    The cache directory is chosen by openxc7.sh: CAAS_CHIPDB, /chipdb if it exists, or
+    ~/.cache/caas/chipdb.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or 1) as ex:
+        return list(ex.map(_warm_one, parts))
+
+def chipdb_warm_cli(spec, workers):
+    """Command line wrapper of chipdb_warm(), spec is a comma separated list or a file of parts"""
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            parts = [l.strip() for l in f if l.strip() and not l.strip().startswith('#')]
+    else:
+        parts = [p for p in spec.split(',') if p]
+    if not parts or not all(validate_part_field(p, 'part') for p in parts):
+        print('No valid part given!')
+        sys.exit(1)
+    results = chipdb_warm(parts, workers)
+    print(json.dumps(results, indent=2))
+    if not all(r['ok'] for r in results):
+        sys.exit(1)
+
+def job_resources(backend, part):
+    """(memory GB, CPUs) to give a build of part on backend"""
+    for b, prefix, mem, cpus in job_resources_table:
+        if b == backend and part.lower().startswith(prefix):
+            return (mem, cpus)
+    return job_resources_default
+
+def machine_budget():
+    """(memory GB, CPUs) the worker may hand out on this machine"""
+    mem = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1 << 30)
+    return (max(1, int(mem) - worker_reserved_mem), os.cpu_count() or 1)
+
+def queue_path(root, state):
+    path = os.path.join(root, state)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def enqueue(proj_dir, root=None, sim=False, both=False):
+    """Queue a project directory for caasw worker, return the name of its queue entry"""
+    root = root or os.environ.get(queue_env) or queue_default
+    name = '%d-%s.json' % (time.time_ns(), os.path.basename(os.path.abspath(proj_dir)))
+    tmp = os.path.join(queue_path(root, 'tmp'), name)
+    with open(tmp, 'w') as f:
+        json.dump({'proj_dir': os.path.abspath(proj_dir), 'sim': sim, 'both': both, 'enqueued_at': time.time()}, f)
+    # entries appear in pending/ complete, a worker never reads half a file
+    os.rename(tmp, os.path.join(queue_path(root, 'pending'), name))
+    return name
+
+def run_queued(job, mem, cpus, pool=False):
+    """Build one queued project with the given limits, return its result record"""
+    proj_dir = job['proj_dir']
+    sim = job.get('sim', False)
+    both = job.get('both', False)
+    script = os.path.join(proj_dir, GENERIC_BOTH_SH_NAME if both else GENERIC_SIM_SH_NAME if sim else GENERIC_SH_NAME)
+    start = time.time()
+    if not os.path.isfile(script):
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                generate(os.path.join(proj_dir, caas_conf_default), proj_dir, overwrite=True, sim=sim, both=both)
+        except (CaasError, OSError) as e:
+            return dict(job, ok=False, error=str(e))
+    env = dict(os.environ, CAAS_MEM='%dg' % mem, CAAS_CPUS=str(cpus))
+    if pool:
+        env['DOCKER_EXEC'] = '%s %s pool-exec' % (sys.executable, os.path.abspath(__file__))
+    try:
+        os.makedirs(os.path.join(proj_dir, result_dir), exist_ok=True)
+        with open(os.path.join(proj_dir, result_dir, 'worker.log'), 'w') as log:
+            ret = subprocess.run([script], cwd=proj_dir, env=env, stdin=subprocess.DEVNULL,
+                                 stdout=log, stderr=subprocess.STDOUT).returncode
+    except OSError as e:
+        # e.g. a script without the exec bit or a project directory removed meanwhile
+        return dict(job, ok=False, error=str(e), mem_gb=mem, cpus=cpus, seconds=round(time.time() - start, 2))
+    return dict(job, ok=ret == 0, exit=ret, mem_gb=mem, cpus=cpus, seconds=round(time.time() - start, 2))
+
+def requeue_stale(root):
+    """Move running/ entries of workers that are gone back to pending/, return their names.
+
+    A worker holds a lock on the entry of every job it runs, an entry nobody holds is stale.
+    """
+    running_dir = queue_path(root, 'running')
+    names = []
+    for name in sorted(os.listdir(running_dir)):
+        try:
+            entry = open(os.path.join(running_dir, name))
+        except OSError:
+            continue
+        with entry:
+            try:
+                fcntl.flock(entry, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            os.replace(os.path.join(running_dir, name), os.path.join(queue_path(root, 'pending'), name))
+        names.append(name)
+    return names
+
+def worker(root=None, max_jobs=None, mem_budget=None, cpu_budget=None, drain=False, pool=False):
+    """Run queued projects concurrently within a memory and CPU budget, return the finished results.
+
+    Projects are started oldest first. One that doesn't fit the free budget is overtaken by
+    smaller ones until it has waited worker_backfill_age seconds. With drain, return once the
+    queue is empty, otherwise run forever. With pool, builds run in warm containers (pool_exec).
+    """
+    root = root or os.environ.get(queue_env) or queue_default
+    budget_mem, budget_cpus = machine_budget()
+    budget_mem = mem_budget or budget_mem
+    budget_cpus = cpu_budget or budget_cpus
+    max_jobs = max_jobs or budget_cpus
+    free = [budget_mem, budget_cpus]
+    pending_dir, running_dir = queue_path(root, 'pending'), queue_path(root, 'running')
+    for name in requeue_stale(root):
+        print('Queue entry %s was left running by a worker that is gone, queued again' % name)
+    running = {}
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as ex:
+        while True:
+            for future in [f for f in running if f.done()]:
+                name, mem, cpus, claim = running.pop(future)
+                free[0], free[1] = free[0] + mem, free[1] + cpus
+                result = future.result()
+                results.append(result)
+                with open(os.path.join(queue_path(root, 'done' if result['ok'] else 'failed'), name), 'w') as f:
+                    json.dump(result, f)
+                os.remove(os.path.join(running_dir, name))
+                claim.close()
+                print('[%s] %s' % (result['proj_dir'], 'done' if result['ok'] else 'failed'))
+            names = sorted(os.listdir(pending_dir))
+            for i, name in enumerate(names):
+                if len(running) >= max_jobs:
+                    break
+                try:
+                    with open(os.path.join(pending_dir, name)) as f:
+                        job = json.load(f)
+                    caas_conf = load_conf(os.path.join(job['proj_dir'], caas_conf_default))
+                    # sim resources depend on the simulator, not the part
+                    sim_conf = caas_conf['sim'] if 'sim' in caas_conf else {}
+                    sim_mem, sim_cpus = job_resources('sim', sim_conf.get('simulator', simulator_default))
+                    mem, cpus = job_resources(caas_conf['project'].get('backend', ''), caas_conf['project'].get('part', ''))
+                    if job.get('both'):
+                        # the compilation and the simulation run at the same time
+                        mem, cpus = mem + sim_mem, cpus + sim_cpus
+                    elif job.get('sim'):
+                        mem, cpus = sim_mem, sim_cpus
+                except (OSError, ValueError, CaasError, configparser.Error) as e:
+                    os.replace(os.path.join(pending_dir, name), os.path.join(queue_path(root, 'failed'), name))
+                    print('Queue entry %s dropped: %s' % (name, e))
+                    continue
+                # a job larger than the whole budget runs alone
+                mem, cpus = min(mem, budget_mem), min(cpus, budget_cpus)
+                if mem > free[0] or cpus > free[1]:
+                    if i == 0 and time.time() - job.get('enqueued_at', 0) > worker_backfill_age:
+                        break
+                    continue
+                # the lock moves along with the entry and is held until the job is done
+                try:
+                    claim = open(os.path.join(pending_dir, name))
+                except OSError:
+                    # claimed by another worker
+                    continue
+                try:
+                    fcntl.flock(claim, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.rename(os.path.join(pending_dir, name), os.path.join(running_dir, name))
+                except OSError:
+                    claim.close()
+                    continue
+                free[0], free[1] = free[0] - mem, free[1] - cpus
+                print('[%s] started with %d GB, %d CPUs' % (job['proj_dir'], mem, cpus))
+                running[ex.submit(run_queued, job, mem, cpus, pool)] = (name, mem, cpus, claim)
+            if drain and not running and not os.listdir(pending_dir):
+                return results
+            concurrent.futures.wait(list(running), timeout=worker_poll,
+                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not running:
+                time.sleep(worker_poll)
+
+def enqueue_cli(spec, sim=False, both=False):
+    """Queue a glob or manifest of project directories"""
+    proj_dirs = expand_projects(spec)
+    if not proj_dirs:
+        print('No project directory matches %s!' % spec)
+        sys.exit(1)
+    for d in proj_dirs:
+        print('Queued %s as %s' % (d, enqueue(d, sim=sim, both=both)))
+
+def worker_cli(max_jobs, mem_budget, cpu_budget, drain, pool=False):
+    """Command line wrapper of worker(), print a JSON summary when draining"""
+    start = time.time()
+    with contextlib.redirect_stdout(sys.stderr):
+        results = worker(max_jobs=max_jobs, mem_budget=mem_budget, cpu_budget=cpu_budget, drain=drain, pool=pool)
+    failed = sum(1 for r in results if not r['ok'])
+    print(json.dumps({'total': len(results), 'succeeded': len(results) - failed, 'failed': failed,
+                      'seconds': round(time.time() - start, 2), 'jobs': results}, indent=2))
+    if failed:
+        sys.exit(1)
+
+def parse_docker_run(args):
+    """Split the arguments of a run script's 'docker run' into (options, project dir, env options, image, command)"""
+    valued = ('--pull', '-m', '--memory', '--cpus', '-v', '--volume', '-e', '--env', '--tmpfs', '--user', '-u', '-w')
+    options, env = [], []
+    proj_dir = None
+    i = 0
+    while i < len(args) and args[i].startswith('-'):
+        flag = args[i]
+        value = args[i + 1] if flag in valued else None
+        i = i + (2 if flag in valued else 1)
+        if flag in ('-v', '--volume') and value.endswith(':/mnt'):
+            proj_dir = value[:-len(':/mnt')]
+        elif flag in ('-e', '--env'):
+            env += [flag, value]
+        elif flag in ('--pull', '--tmpfs', '-w') or flag in ('-i', '-t', '-it', '--rm'):
+            # a pool container is always detached, long-lived and gets its own /tmp
+            pass
+        else:
+            options += [flag] + ([value] if value is not None else [])
+    if i >= len(args):
+        return None
+    return (options, proj_dir, env, args[i], args[i + 1:])
+
+def pool_container(docker, root, name, options, image):
+    """Make sure the pool container name is running, return its /mnt directory on the host"""
+    mnt = os.path.join(root, name)
+    running = subprocess.run(docker + ['inspect', '-f', '{{.State.Running}}', name],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    if running != 'true':
+        subprocess.run(docker + ['rm', '-f', name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(mnt, ignore_errors=True)
+        os.makedirs(mnt)
+        if subprocess.run(docker + ['run', '-d', '--pull', 'never', '--name', name] + options +
+                          ['-v', mnt + ':/mnt', '--tmpfs', '/tmp', image, 'tail', '-f', '/dev/null'],
+                          stdout=subprocess.DEVNULL).returncode:
+            return None
+        with open(os.path.join(root, name + '.count'), 'w') as f:
+            f.write('0')
+    return mnt
+
+def pool_wipe(docker, name, mnt):
+    """Empty the /mnt and /tmp of pool container name, return True if its /mnt is empty"""
+    # files made in the container may belong to its user, so it cleans up after itself
+    subprocess.run(docker + ['exec', name, 'sh', '-c', 'rm -rf /mnt/* /mnt/.[!.]* /tmp/*'],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for entry in os.listdir(mnt):
+        path = os.path.join(mnt, entry)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            with contextlib.suppress(OSError):
+                os.remove(path)
+    return not os.listdir(mnt)
+
+def pool_exec(args):
+    """DOCKER_EXEC shim: run a build script's 'docker run' in a warm pool container, return the exit status.
+
+    The project is copied into the container's own /mnt directory and build/ is copied back.
+    Anything else, or every container busy, goes to docker unchanged.
+    """
+    docker = os.environ.get(pool_docker_env, 'docker').split()
+    parsed = parse_docker_run(args[1:]) if args and args[0] == 'run' else None
+    if parsed is None or parsed[1] is None:
+        return subprocess.run(docker + args).returncode
+    options, proj_dir, env, image, command = parsed
+    root = os.environ.get(pool_env) or pool_default
+    os.makedirs(root, exist_ok=True)
+    signature = hashlib.sha256(json.dumps([image, options]).encode()).hexdigest()[:12]
+    for slot in range(pool_size):
+        name = 'caas-pool-%s-%d' % (signature, slot)
+        lock = open(os.path.join(root, name + '.lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            continue
+        with lock:
+            mnt = pool_container(docker, root, name, options, image)
+            if mnt is None:
+                break
+            # an interrupted job may have left its files behind, never build on top of them
+            if not pool_wipe(docker, name, mnt):
+                subprocess.run(docker + ['rm', '-f', name], stdout=subprocess.DEVNULL)
+                break
+            ret = 1
+            try:
+                shutil.copytree(proj_dir, mnt, symlinks=True, dirs_exist_ok=True)
+                ret = subprocess.run(docker + ['exec', '-i'] + env + [name] + command).returncode
+                if os.path.isdir(os.path.join(mnt, result_dir)):
+                    shutil.copytree(os.path.join(mnt, result_dir), os.path.join(proj_dir, result_dir),
+                                    symlinks=True, dirs_exist_ok=True)
+            finally:
+                wiped = pool_wipe(docker, name, mnt)
+                with open(os.path.join(root, name + '.count')) as f:
+                    count = int(f.read() or 0) + 1
+                with open(os.path.join(root, name + '.count'), 'w') as f:
+                    f.write(str(count))
+                if ret or not wiped or count >= pool_recycle_after:
+                    subprocess.run(docker + ['rm', '-f', name], stdout=subprocess.DEVNULL)
+                    os.remove(os.path.join(root, name + '.count'))
+            return ret
+    # no free warm container
+    return subprocess.run(docker + args).returncode
+
+def pool_clean():
+    """Remove all pool containers"""
+    docker = os.environ.get(pool_docker_env, 'docker').split()
+    root = os.environ.get(pool_env) or pool_default
+    for count in glob.glob(os.path.join(root, 'caas-pool-*.count')):
+        name = os.path.basename(count)[:-len('.count')]
+        subprocess.run(docker + ['rm', '-f', name], stdout=subprocess.DEVNULL)
+        os.remove(count)
+
+def requestexp(e):
+    print("Exception occured when communicating with server: ", e)
+
+def collect_files(proj_dir, patterns):
+    """Expand comma separated glob patterns relative to proj_dir once, return sorted relative file paths"""
+    files = set()
+    root = os.path.abspath(proj_dir)
+    for pattern in patterns.split(','):
+        if not pattern:
+            continue
+        for match in glob.glob(os.path.join(root, pattern)):
+            # like zip -r, a matched directory is added recursively
+            if os.path.isdir(match):
+                for dirpath, _, filenames in os.walk(match):
+                    files.update(os.path.join(dirpath, fn) for fn in filenames)
+            else:
+                files.add(match)
+    rel_files = []
+    for f in sorted(files):
+        rel = os.path.relpath(f, root)
+        if rel.startswith('..'):
+            print('Skip %s: outside of project directory' % rel)
+            continue
+        if rel in (upload_file, caas_armed_file):
+            continue
+        rel_files.append(rel)
+    return rel_files
+
+def write_archive(archive, proj_dir, files, conf_bytes):
+    """Write the upload zip: config as .caas.conf plus files, streamed from disk in chunks"""
+    tmp = archive + '.tmp'
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(caas_armed_file, conf_bytes)
+        print("  adding: %s" % caas_armed_file)
+        for rel in files:
+            path = os.path.join(proj_dir, rel)
+            zinfo = zipfile.ZipInfo.from_file(path, rel)
+            stored = os.path.splitext(rel)[1].lower() in stored_suffixes
+            zinfo.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, zf.open(zinfo, 'w') as dst:
+                shutil.copyfileobj(src, dst, zip_chunk_size)
+            print("  adding: %s (%s)" % (rel, 'stored' if stored else 'deflated'))
+    os.replace(tmp, archive)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(zip_chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def hash_files(proj_dir, files):
+    """Return {relative path: sha256}, reusing digests from the project hash cache when size and mtime match"""
+    cache_path = os.path.join(proj_dir, hash_cache_file)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    new_cache = {}
+    manifest = {}
+    for rel in files:
+        path = os.path.join(proj_dir, rel)
+        st = os.stat(path)
+        entry = cache.get(rel)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            digest = entry[2]
+        else:
+            digest = file_sha256(path)
+        new_cache[rel] = [st.st_size, st.st_mtime_ns, digest]
+        manifest[rel] = digest
+    if new_cache != cache:
+        with open(cache_path, 'w') as f:
+            json.dump(new_cache, f)
+    return manifest
+
+def assign_jobid(proj_dir, newjobid=False):
+    """Reuse the jobID stored in the project, or create a new random one"""
     jobidfile = os.path.join(proj_dir, jobid_file)
     if os.path.isfile(jobidfile) and not newjobid:
         with open(jobidfile) as f:
@@ -486,108 +1430,956 @@ def submit(conf_file, proj_dir, dryrun, newjobid):
         print("Use a new random jobID " + jobid)
         with open(jobidfile, 'w') as f:
             f.write(jobid)
-    if dryrun:
-        print("Dryrun, stop here.")
-        return
-    print(term_white + "Submitting to compiling server..." + term_orig)
-    server = caas_conf['caas'].get('server', local_server)
-    print("Using server at " + server)
-    server_submit = urllib.parse.urljoin(server, 'submit')
-    server_status = urllib.parse.urljoin(server, 'status/' + str(jobid))
-    server_bit_dl = urllib.parse.urljoin(server, 'download/' + str(jobid) + '/bitstream')
-    server_log_dl = urllib.parse.urljoin(server, 'download/' + str(jobid) + '/log')
+    return jobid
+
+def package(config, proj_dir='.', newjobid=False, archive=True, sim=False, both=False):
+    """Prepare a project for submission, return a dict with the archive path, file manifest and jobID.
+
+    config is a caas.conf path or a ConfigParser. With archive=False the zip is not
+    written, only the manifest of {path: sha256} is built. With sim, the job is a
+    simulation, with both a compilation and a simulation. Raises CaasError on failure.
+    """
+    if not os.path.exists(proj_dir):
+        raise CaasError('Project directory %s not found!' % proj_dir)
+    caas_conf = load_conf(config)
+    
+    # Validate configuration values for special characters
+    # This is "frontend", but server will do a validation on the backend nonetheless
+    if not validate_config_values(caas_conf, check_part=both or not sim):
+        raise CaasError('Configuration input validation failed! Please fix the invalid values in your configuration file.')
+    
+    constraint = caas_conf['project'].get('constraint', constraint_default)
+    sources = caas_conf['project'].get('sources', sources_default)
+    misc = caas_conf['project'].get('misc', misc_default)
+    if isinstance(config, configparser.ConfigParser):
+        conf_text = io.StringIO()
+        caas_conf.write(conf_text)
+        conf_bytes = conf_text.getvalue().encode()
+    else:
+        with open(config, 'rb') as f:
+            conf_bytes = f.read()
+    files = collect_files(proj_dir, ','.join([constraint, sources, misc]))
+    archive_path = None
+    try:
+        manifest = hash_files(proj_dir, files)
+        manifest[caas_armed_file] = hashlib.sha256(conf_bytes).hexdigest()
+        if archive:
+            print("Archive project...")
+            archive_path = os.path.join(proj_dir, upload_file)
+            write_archive(archive_path, proj_dir, files, conf_bytes)
+    except OSError as e:
+        raise CaasError("Error archiving project! " + str(e))
+    jobid = assign_jobid(proj_dir, newjobid)
+    return {'proj_dir': proj_dir, 'archive': archive_path, 'jobid': jobid, 'conf': caas_conf,
+            'files': files, 'manifest': manifest, 'conf_bytes': conf_bytes, 'sim': sim or both, 'both': both}
+
+def submit_fields(payload):
+    """Form fields of a submit request besides the project files"""
+    fields = {'inputJobId': payload['jobid']}
+    if payload.get('sim'):
+        fields['inputSim'] = '1'
+    # a simulation that also compiles, see generate(both=True)
+    if payload.get('both'):
+        fields['inputCompile'] = '1'
+    return fields
+
+def submit_manifest(server, payload, http=None):
+    """Submit by content-addressed manifest, uploading only the blobs the server is missing.
+
+    http is a requests.Session or the requests module. Return the submit
+    response, or None if the server doesn't support manifests.
+    """
+    if http is None:
+        import requests as http
+    manifest = payload['manifest']
+    response = http.post(urllib.parse.urljoin(server, 'manifest'),
+                         json={'jobid': payload['jobid'], 'files': manifest})
+    if response.status_code != 200:
+        return None
+    missing = set(json.loads(response.text).get('missing', []))
+    sources = {}
+    for rel, digest in manifest.items():
+        if digest in missing and digest not in sources:
+            sources[digest] = rel
+    print("%d of %d files already on server, uploading %d" % (len(manifest) - len(sources), len(manifest), len(sources)))
+    for digest, rel in sources.items():
+        url = urllib.parse.urljoin(server, 'blob/' + digest)
+        if rel == caas_armed_file:
+            response = http.put(url, data=payload['conf_bytes'])
+        else:
+            with open(os.path.join(payload['proj_dir'], rel), 'rb') as f:
+                response = http.put(url, data=f)
+        if response.status_code != 200:
+            raise CaasError('Uploading %s failed with code %d' % (rel, response.status_code))
+    return http.post(urllib.parse.urljoin(server, 'submit'),
+                     data=dict(submit_fields(payload), inputManifest=json.dumps(manifest)))
+
+def submit_archive(server, payload, http=None):
+    """Submit by uploading the whole project zip"""
+    if http is None:
+        import requests as http
+    if payload['archive'] is None:
+        print("Archive project...")
+        payload['archive'] = os.path.join(payload['proj_dir'], upload_file)
+        write_archive(payload['archive'], payload['proj_dir'], payload['files'], payload['conf_bytes'])
+    with open(payload['archive'], 'rb') as f:
+        return http.post(urllib.parse.urljoin(server, 'submit'),
+                         data=submit_fields(payload),
+                         files={'inputZipFile': ('job.zip', f, 'application/zip')})
+
+def post_job_failover(servers, payload, fullupload=False, http=None):
+    """Upload a prepared project to the first of servers that takes it, return (server, submit response).
+
+    A network error or server error moves on to the next server, a rejection of the job doesn't.
+    Return (None, None) if no server could be reached.
+    """
+    response = None
+    for server in servers:
+        print("Using server at " + server)
+        start = time.time()
+        try:
+            response = post_job(server, payload, fullupload, http)
+        except Exception as e:
+            requestexp(e)
+            server_record(server, failed=True)
+            response = None
+            continue
+        if response.status_code >= 500:
+            print("POST failed with code", response.status_code)
+            server_record(server, failed=True)
+            continue
+        server_record(server, time.time() - start)
+        return (server, response)
+    return (None, response)
+
+def post_job(server, payload, fullupload=False, http=None):
+    """Upload a prepared project, return the submit response"""
+    response = None if fullupload else submit_manifest(server, payload, http)
+    if response is None:
+        response = submit_archive(server, payload, http)
+    return response
+
+def poll_delay(count, retry_after=None):
+    """Seconds to wait before the count-th status query"""
+    if retry_after is not None:
+        return max(poll_base, min(retry_after, poll_retry_after_max))
+    delay = min(poll_cap, poll_base * 2 ** (count - 1))
+    # equal jitter, so clients submitted together don't poll in lockstep
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def parse_retry_after(response):
+    """Retry-After header in seconds, or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - time.time())
+
+def query_status(server_status, http):
+    """One status query, return (status text or None on error, retry_after, throttled)"""
     try:
-        response = requests.post(server_submit,
-                                 data={'inputJobId': jobid},
-                                 files={'inputZipFile': ('job.zip',
-                                                         open(os.path.join(proj_dir, upload_file), 'rb'),
-                                                         'application/zip')})
+        response = http.get(server_status)
     except Exception as e:
         requestexp(e)
-        return
-
+        return (None, None, False)
+    retry_after = parse_retry_after(response)
     if response.status_code == 200:
-        print("POST done.")
-        reply = json.loads(response.text)
-        if reply['code'] == '0':
-            print("Compilation cannot be submitted: ", reply['msg'])
-            return
+        return (response.text, retry_after, False)
+    print("Status query GET failed with code", response.status_code)
+    # the server asking us to slow down is not a network error
+    return (None, retry_after, response.status_code in (429, 503))
+
+def status_polls(interval=None):
+    """The status poll loop of one job without the I/O, shared by the sync and async clients.
+
+    A generator that yields the seconds to wait before each status query and is sent that
+    query's query_status() result. It stops with the final status as its value, or None after
+    a few network errors or poll_throttled_max seconds of throttling. interval replaces the backoff.
+    """
+    count = 0
+    errcnt = 0
+    throttled_since = None
+    retry_after = None
+    while True:
+        count = count + 1
+        delay = interval if interval is not None and retry_after is None else poll_delay(count, retry_after)
+        status, retry_after, throttled = yield delay
+        if status is not None:
+            throttled_since = None
+            if not 'running' in status:
+                return status
+        elif throttled:
+            if throttled_since is None:
+                throttled_since = time.monotonic()
+            elif time.monotonic() - throttled_since > poll_throttled_max:
+                return None
         else:
-            print(term_white + "Compilation submitted, now quering result..." + term_orig)
-    else:
-        print("POST failed with code", response.status_code)
-        return
+            throttled_since = None
+            errcnt = errcnt + 1
+            if errcnt > 3:
+                return None
+
+def poll_status(server_status, http, query=query_status, interval=None):
+    """Query server_status until the job leaves the running state, return the final status or None on error"""
+    polls = status_polls(interval)
+    delay = next(polls)
+    while True:
+        time.sleep(delay)
+        reply = query(server_status, http)
+        if reply[0] is not None:
+            print("Status query: ", reply[0])
+        try:
+            delay = polls.send(reply)
+        except StopIteration as stop:
+            return stop.value
+
+def wait_status_push(server, jobid, http):
+    """Wait for a job on one Server-Sent Events connection to status/<jobid>/events.
+
+    Return the final status, or None if the server doesn't support it or the stream broke.
+    """
+    url = urllib.parse.urljoin(server, 'status/' + str(jobid) + '/events')
+    try:
+        with http.get(url, stream=True, headers={'Accept': 'text/event-stream'},
+                      timeout=(10, push_read_timeout)) as response:
+            if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+                return None
+            for line in response.iter_lines(decode_unicode=True):
+                # blank lines end an event, lines starting with ':' are keep-alives
+                if not line or not line.startswith('data:'):
+                    continue
+                status = line[5:].strip()
+                print("Status push: ", status)
+                if not 'running' in status:
+                    return status
+    except Exception as e:
+        requestexp(e)
+    return None
 
-    status = 'undefined'
-    interval = 2
+def tail_log(server, jobid, offset, http):
+    """Fetch the build log of a running job from offset on, return (bytes, next offset, job status).
+
+    Return None on error, or if the server cannot stream logs.
+    """
+    url = urllib.parse.urljoin(server, 'download/%s/log?offset=%d' % (jobid, offset))
+    try:
+        response = http.get(url, timeout=(10, 60))
+    except Exception as e:
+        requestexp(e)
+        return None
+    if response.status_code != 200 or 'X-Log-Offset' not in response.headers or 'X-Job-Status' not in response.headers:
+        return None
+    return (response.content, int(response.headers['X-Log-Offset']), response.headers['X-Job-Status'])
+
+def follow_log(server, jobid, http):
+    """Print the build log while the job runs, return the final status.
+
+    Return None on network error, or if the server cannot stream logs.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    offset = 0
     count = 0
     errcnt = 0
-    while True: 
+    status = None
+    while True:
+        tail = tail_log(server, jobid, offset, http)
+        if tail is None:
+            errcnt = errcnt + 1
+            # a server that never answered doesn't stream logs, let the caller poll instead
+            if offset == 0 and count == 0 or errcnt > 3:
+                return None
+        else:
+            errcnt = 0
+            data, offset, status = tail
+            if data:
+                sys.stdout.write(decoder.decode(data))
+                sys.stdout.flush()
+                # more may be waiting right away, and the next poll comes soon again
+                count = 0
+                continue
+            if not 'running' in status:
+                return status
         count = count + 1
-        if count > 3:
-            interval = 5
-        elif count > 6:
-            interval = 10
-        if errcnt > 3:
-            print(term_white + "Network error when fetching result." + term_orig)
-            return
-        time.sleep(interval)
+        time.sleep(min(log_follow_cap, poll_delay(count)))
+
+def wait_status(server, jobid, push=False, http=None, follow=False):
+    """Wait until the job leaves the running state, return the final status or None on network error.
+
+    With follow, the build log is printed while the job runs.
+    """
+    if http is None:
+        import requests as http
+    if follow:
+        status = follow_log(server, jobid, http)
+        if status is not None:
+            return status
+        print("Log streaming not available, falling back to polling.")
+    elif push:
+        status = wait_status_push(server, jobid, http)
+        if status is not None:
+            return status
+        print("Push not available, falling back to polling.")
+    return poll_status(urllib.parse.urljoin(server, 'status/' + str(jobid)), http)
+
+def expected_sha256(response):
+    """Hex SHA-256 of the whole artifact announced by the server, or None"""
+    value = response.headers.get('X-Checksum-Sha256')
+    if value:
+        return value.strip().lower()
+    # RFC 9530 Repr-Digest: sha-256=:base64:, RFC 3230 Digest: SHA-256=base64
+    for name in ('Repr-Digest', 'Digest'):
+        for item in response.headers.get(name, '').split(','):
+            algo, _, value = item.strip().partition('=')
+            if algo.lower() == 'sha-256' and value:
+                try:
+                    return base64.b64decode(value.strip(':')).hex()
+                except ValueError:
+                    pass
+    return None
+
+def download_artifact(url, dest, http=None, key=None):
+    """Stream url to dest, resuming a partial download with Range and verifying the server checksum.
+
+    Data goes to dest.<key>.part first (key is the job id) and is renamed once complete. A server
+    may send the artifact gzip or zstd compressed, it is decompressed while downloading.
+    Return True on success.
+    """
+    if http is None:
+        import requests as http
+    part = dest + ('.%s.part' % key if key else '.part')
+    etag_file = part + '.etag'
+    # partial downloads of other jobs are of no use for this one
+    for stale in glob.glob(glob.escape(dest) + '.*part') + glob.glob(glob.escape(dest) + '.*part.etag'):
+        if stale not in (part, etag_file):
+            os.remove(stale)
+    for attempt in range(download_retries):
+        # without an ETag there is no telling whether the partial file is of this artifact
+        if os.path.isfile(part) and not os.path.isfile(etag_file):
+            os.remove(part)
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            # only resume if the artifact is still the one we started on
+            with open(etag_file) as f:
+                headers['If-Range'] = f.read()
         try:
-            response = requests.get(server_status)
+            with http.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                if response.status_code == 416:
+                    # our partial file is no good for this artifact, start over
+                    os.remove(part)
+                    continue
+                if response.status_code not in (200, 206):
+                    print("Request failed: ", response.status_code)
+                    return False
+                if response.status_code == 200:
+                    offset = 0
+                h = hashlib.sha256()
+                if offset:
+                    with open(part, 'rb') as f:
+                        for chunk in iter(lambda: f.read(download_chunk_size), b''):
+                            h.update(chunk)
+                if response.headers.get('ETag'):
+                    with open(etag_file, 'w') as f:
+                        f.write(response.headers['ETag'])
+                with open(part, 'ab' if offset else 'wb') as f:
+                    for chunk in response.iter_content(download_chunk_size):
+                        f.write(chunk)
+                        h.update(chunk)
+                expected = expected_sha256(response)
         except Exception as e:
             requestexp(e)
-            errcnt = errcnt + 1
             continue
-        if response.status_code == 200:
-            print("Status query: ", response.text)
-            if not 'running' in response.text:
-                status = response.text
-                break
-        else:
-            print("Status query GET failed with code", response.status_code)
-            errcnt = errcnt + 1
+        if expected and h.hexdigest() != expected:
+            print("Checksum mismatch for %s, downloading again." % os.path.basename(dest))
+            os.remove(part)
             continue
+        os.replace(part, dest)
+        if os.path.isfile(etag_file):
+            os.remove(etag_file)
+        return True
+    return False
 
-    success = 'succeeded' in status
-    if not success:
-        print(term_white + "Compilation failed." + term_orig)
+def download_results(server, jobid, proj_dir, success, http=None, parallel=False, artifacts=None):
+    """Download the job artifacts into the build directory, return the names downloaded.
+
+    artifacts defaults to result_artifacts, the bitstream (or waveform) is only fetched if
+    the job succeeded. With parallel, artifacts are fetched concurrently. A downloaded log
+    is summarized into build/summary.json.
+    """
+    result_dir_abs = os.path.join(proj_dir, result_dir)
+    if not os.path.exists(result_dir_abs):
+        os.makedirs(result_dir_abs)
+    wanted = [a for a in artifacts or result_artifacts if success or not a[3]]
+
+    def fetch(artifact):
+        endpoint, name, label, _ = artifact
+        url = urllib.parse.urljoin(server, 'download/' + str(jobid) + '/' + endpoint)
+        if download_artifact(url, os.path.join(result_dir_abs, name), http, key=jobid):
+            print(term_white + label + " downloaded." + term_orig)
+            return name
+        return None
+
+    if parallel and len(wanted) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(wanted)) as ex:
+            names = list(ex.map(fetch, wanted))
     else:
-        print(term_white + "Compilation succeeded, fetching result..." + term_orig)
+        names = [fetch(a) for a in wanted]
+    names = [n for n in names if n]
+    if result_log_name in names:
+        summary = write_summary(proj_dir)
+        print("Summary: %d errors, %d warnings, worst slack %s, in %s/%s." % (
+            summary['errors'], summary['warnings'], 'n/a' if summary['wns_ns'] is None else '%g ns' % summary['wns_ns'],
+            result_dir, result_summary_name))
+    return names
+
+def registry_open(path=None):
+    """Open the job registry, creating it if needed"""
+    path = path or os.environ.get(registry_env) or registry_default
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        jobid TEXT PRIMARY KEY, server TEXT NOT NULL, proj_dir TEXT NOT NULL,
+        state TEXT NOT NULL, status TEXT,
+        submitted_at REAL, upload_seconds REAL, finished_at REAL, downloaded_at REAL,
+        polls INTEGER NOT NULL DEFAULT 0)""")
+    db.execute("""CREATE TABLE IF NOT EXISTS servers (
+        server TEXT PRIMARY KEY, latency REAL, failures INTEGER NOT NULL DEFAULT 0, updated_at REAL)""")
+    return db
 
+def registry_update(jobid, **fields):
+    """Insert or update one job in the registry. A broken registry never fails a submission.
+
+    A (re)submission, given by submitted_at, starts the job's record afresh.
+    """
+    if 'submitted_at' in fields:
+        # a reused job id must not keep the timings and status of its last run
+        fields = dict({'status': None, 'finished_at': None, 'downloaded_at': None, 'polls': 0}, **fields)
     try:
-        response = requests.get(server_log_dl)
-        if response.status_code == 200:
-            result_dir_abs = os.path.join(proj_dir, result_dir)
-            if not os.path.exists(result_dir_abs):
-                os.makedirs(result_dir_abs)
-            with open(os.path.join(result_dir_abs, result_log_name), "wb") as f:
-                f.write(response.content)
-            print(term_white + "Log downloaded." + term_orig)
+        with contextlib.closing(registry_open()) as db, db:
+            if 'server' in fields:
+                db.execute('INSERT OR IGNORE INTO jobs (jobid, server, proj_dir, state) VALUES (?, ?, ?, ?)',
+                           (jobid, fields['server'], fields['proj_dir'], fields.get('state', 'running')))
+            db.execute('UPDATE jobs SET ' + ', '.join(k + ' = ?' for k in fields) + ' WHERE jobid = ?',
+                       list(fields.values()) + [jobid])
+    except sqlite3.Error as e:
+        print('Job registry not updated: %s' % e)
+
+def registry_jobs(jobids=None, pending=False):
+    """Jobs in the registry as dicts, oldest first"""
+    query = 'SELECT * FROM jobs'
+    if pending:
+        query = query + " WHERE state = 'running'"
+    with contextlib.closing(registry_open()) as db:
+        rows = [dict(r) for r in db.execute(query + ' ORDER BY submitted_at')]
+    return [r for r in rows if jobids is None or r['jobid'] in jobids]
+
+def server_record(server, seconds=None, failed=False):
+    """Remember a server's request latency, smoothed over runs, or count a failure"""
+    try:
+        with contextlib.closing(registry_open()) as db, db:
+            db.execute('INSERT OR IGNORE INTO servers (server) VALUES (?)', (server,))
+            if failed:
+                db.execute('UPDATE servers SET failures = failures + 1, updated_at = ? WHERE server = ?',
+                           (time.time(), server))
+            else:
+                db.execute('UPDATE servers SET latency = coalesce((1 - ?) * latency + ? * ?, ?), failures = 0, '
+                           'updated_at = ? WHERE server = ?',
+                           (server_latency_alpha, server_latency_alpha, seconds, seconds, time.time(), server))
+    except sqlite3.Error as e:
+        print('Server statistics not updated: %s' % e)
+
+def server_stats():
+    """{server: {'latency': seconds or None, 'failures': consecutive failures}} from the registry"""
+    try:
+        with contextlib.closing(registry_open()) as db:
+            return {r['server']: dict(r) for r in db.execute('SELECT * FROM servers')}
+    except sqlite3.Error:
+        return {}
+
+def caas_servers(caas_conf):
+    """Servers listed in [caas] server, comma separated, local_server without any"""
+    value = caas_conf['caas'].get('server', local_server) if 'caas' in caas_conf else local_server
+    return [s.strip() for s in value.split(',') if s.strip()] or [local_server]
+
+def probe_server(server, http):
+    """GET load of a server, return (queued and running jobs per worker or None if not reported, seconds).
+
+    Return None if the server can't be reached.
+    """
+    start = time.time()
+    try:
+        response = http.get(urllib.parse.urljoin(server, 'load'), timeout=server_probe_timeout)
+    except Exception:
+        return None
+    seconds = time.time() - start
+    if response.status_code >= 500:
+        return None
+    try:
+        info = json.loads(response.text)
+        return ((info['queued'] + info['running']) / max(1, info['workers']), seconds)
+    except (ValueError, KeyError, TypeError):
+        return (None, seconds)
+
+def rank_servers(servers, http=None):
+    """Order servers best first, by load and remembered latency, unreachable ones last.
+
+    A single server is returned as is, without probing.
+    """
+    if len(servers) < 2:
+        return servers
+    if http is None:
+        import requests as http
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(servers)) as ex:
+        probes = list(ex.map(lambda server: probe_server(server, http), servers))
+    for server, probe in zip(servers, probes):
+        if probe is None:
+            server_record(server, failed=True)
         else:
-            print("Request failed: ", response.status_status)
-    except Exception as e:
-        requestexp(e)
+            server_record(server, probe[1])
+    stats = server_stats()
+    ranked = []
+    for i, (server, probe) in enumerate(zip(servers, probes)):
+        stat = stats.get(server, {})
+        if probe is None:
+            ranked.append(((1, stat.get('failures', 0), i), server))
+        else:
+            score = (probe[0] or 0) + server_latency_weight * (stat.get('latency') or probe[1])
+            ranked.append(((0, score, i), server))
+            print("Server %s: load %s, latency %.3fs" % (server, 'unknown' if probe[0] is None else '%.2f' % probe[0],
+                                                         stat.get('latency') or probe[1]))
+    return [server for _, server in sorted(ranked)]
 
-    if not success:
+def query_status_batch(server, jobids, http):
+    """Status of many jobs in one GET status?jobs=..., return {jobid: status} or None if unsupported"""
+    url = urllib.parse.urljoin(server, 'status') + '?' + urllib.parse.urlencode({'jobs': ','.join(jobids)})
+    try:
+        response = http.get(url)
+        if response.status_code != 200:
+            return None
+        reply = response.json()
+    except Exception:
+        return None
+    if not isinstance(reply, dict):
+        return None
+    return reply
+
+def finish_job(job, status, http):
+    """Record a finished job and fetch its results into its project directory"""
+    success = 'succeeded' in status
+    registry_update(job['jobid'], state='succeeded' if success else 'failed', status=status,
+                    finished_at=time.time(), polls=job['polls'])
+    print("[%s] %s %s" % (job['proj_dir'], job['jobid'], status))
+    if not os.path.isdir(job['proj_dir']):
+        print("Project directory %s is gone, results not downloaded." % job['proj_dir'])
         return
+    download_results(job['server'], job['jobid'], job['proj_dir'], success, http=http)
+    registry_update(job['jobid'], downloaded_at=time.time())
 
+def watch(jobids=None, http=None):
+    """Poll all running jobs of the registry from one process until they finish, return them.
+
+    Jobs on the same server are queried with one batch request when the server supports it.
+    """
+    if http is None:
+        import requests
+        http = requests.Session()
+    jobs = registry_jobs(jobids, pending=True)
+    done = []
+    count = 0
+    errcnt = {}
+    while jobs:
+        count = count + 1
+        servers = {}
+        for job in jobs:
+            servers.setdefault(job['server'], []).append(job)
+        retry_after = None
+        still = []
+        for server, server_jobs in servers.items():
+            batch = query_status_batch(server, [j['jobid'] for j in server_jobs], http)
+            for job in server_jobs:
+                job['polls'] = job['polls'] + 1
+                if batch is not None:
+                    status = batch.get(job['jobid'])
+                else:
+                    status, ra, throttled = query_status(urllib.parse.urljoin(server, 'status/' + job['jobid']), http)
+                    if ra is not None:
+                        retry_after = max(retry_after or 0, ra)
+                    if status is None and throttled:
+                        still.append(job)
+                        continue
+                if status is None:
+                    # unknown to the server or unreachable, give up on it after a few tries
+                    errcnt[job['jobid']] = errcnt.get(job['jobid'], 0) + 1
+                    if errcnt[job['jobid']] > 3:
+                        registry_update(job['jobid'], state='error', status='status unavailable', polls=job['polls'])
+                        done.append(dict(job, state='error'))
+                    else:
+                        still.append(job)
+                elif 'running' in status:
+                    still.append(job)
+                else:
+                    finish_job(job, status, http)
+                    done.append(dict(job, state='succeeded' if 'succeeded' in status else 'failed', status=status))
+        jobs = still
+        if jobs:
+            time.sleep(poll_delay(count, retry_after))
+    # with the timings recorded on the way
+    return registry_jobs([j['jobid'] for j in done]) if done else []
+
+def watch_cli(spec):
+    """Command line wrapper of watch(), spec is a comma separated list of job ids or empty for all"""
+    jobids = [j for j in spec.split(',') if j] if spec else None
     try:
-        response = requests.get(server_bit_dl)
+        with contextlib.redirect_stdout(sys.stderr):
+            done = watch(jobids)
+    except sqlite3.Error as e:
+        print('Job registry error: %s' % e)
+        sys.exit(1)
+    failed = sum(1 for j in done if j['state'] != 'succeeded')
+    print(json.dumps({'total': len(done), 'succeeded': len(done) - failed, 'failed': failed, 'jobs': done}, indent=2))
+    if failed:
+        sys.exit(1)
+
+def status_cli(spec):
+    """Print the jobs in the registry with their timings"""
+    jobids = [j for j in spec.split(',') if j] if spec else None
+    try:
+        jobs = registry_jobs(jobids)
+    except sqlite3.Error as e:
+        print('Job registry error: %s' % e)
+        sys.exit(1)
+    now = time.time()
+    for job in jobs:
+        end = job['finished_at'] or now
+        submitted = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['submitted_at'])) if job['submitted_at'] else '-'
+        print('%-24s %-10s %s %7.1fs  %s' % (job['jobid'], job['state'], submitted,
+                                            end - (job['submitted_at'] or end), job['proj_dir']))
+
+def percentile(values, p):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summarize_stage(samples):
+    seconds = [x['seconds'] for x in samples]
+    rss = [x['peak_rss_kb'] / 1024 for x in samples if x.get('peak_rss_kb') is not None]
+    summary = {'count': len(samples), 'failed': sum(1 for x in samples if x.get('exit')),
+               'total_seconds': round(sum(seconds), 1)}
+    for p in (50, 90, 99):
+        summary['p%d_seconds' % p] = round(percentile(seconds, p), 3)
+    for p in (50, 99):
+        summary['p%d_rss_mb' % p] = round(percentile(rss, p), 1) if rss else None
+    return summary
+
+def report(proj_dirs):
+    """Aggregate build/metrics.json of many projects into per-backend and per-part stage percentiles.
+
+    Every build also counts as a 'total' stage, from the start of its first stage to the end
+    of its last one, so nested (Vivado's steps) and parallel stages are not counted twice.
+    """
+    groups = {'backend': {}, 'part': {}}
+    builds = 0
+    for d in proj_dirs:
+        try:
+            with open(os.path.join(d, result_dir, result_metrics_name)) as f:
+                metrics = json.load(f)
+        except (OSError, ValueError):
+            continue
+        builds = builds + 1
+        stages = metrics.get('stages', [])
+        starts = [x['start'] for x in stages if x.get('start') is not None]
+        ends = [x['start'] + x['seconds'] for x in stages if x.get('start') is not None]
+        total = {'stage': 'total', 'seconds': max(ends) - min(starts) if starts else sum(x['seconds'] for x in stages),
+                 'peak_rss_kb': max((x['peak_rss_kb'] for x in stages if x.get('peak_rss_kb') is not None), default=None),
+                 'exit': max((x['exit'] for x in stages), default=0)}
+        for x in stages + [total]:
+            for key in groups:
+                groups[key].setdefault(metrics.get(key, 'unknown'), {}).setdefault(x['stage'], []).append(x)
+    result = {'builds': builds}
+    for key, group in groups.items():
+        result['by_' + key] = {name: {stage: summarize_stage(samples) for stage, samples in stages.items()}
+                               for name, stages in sorted(group.items())}
+    return result
+
+def report_cli(spec):
+    """Command line wrapper of report(), print JSON"""
+    proj_dirs = expand_projects(spec)
+    result = report(proj_dirs)
+    if not result['builds']:
+        print('No %s/%s found in %s!' % (result_dir, result_metrics_name, spec))
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+
+def summarize_log(path):
+    """Pull errors, warnings, utilization and timing out of a build log, return a dict.
+
+    The log is memory-mapped and scanned once by log_summary_re, so logs of any size are
+    never loaded into memory. The last report of a resource or clock wins, that is the
+    post-route one. Worst slack is Vivado's WNS, or derived from nextpnr's Fmax lines.
+    """
+    summary = {'log': os.path.basename(path), 'errors': 0, 'warnings': 0, 'error_messages': [],
+               'warning_messages': [], 'utilization': {}, 'clocks': {}, 'wns_ns': None, 'tns_ns': None}
+    if os.path.getsize(path) == 0:
+        return summary
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        end = mm.find(b'\n')
+        # the first line has no newline before it
+        first = b'\n' + mm[:end if end >= 0 else len(mm)]
+        for m in itertools.chain(log_summary_re.finditer(first), log_summary_re.finditer(mm)):
+            if m.group('error') is not None:
+                summary['errors'] += 1
+                if summary['errors'] <= summary_max_messages:
+                    summary['error_messages'].append(m.group('error').decode(errors='replace').rstrip())
+            elif m.group('warning') is not None:
+                summary['warnings'] += 1
+                if summary['warnings'] <= summary_max_messages:
+                    summary['warning_messages'].append(m.group('warning').decode(errors='replace').rstrip())
+            elif m.group('bel') is not None:
+                summary['utilization'][m.group('bel').decode()] = {'used': int(m.group('used')), 'available': int(m.group('avail'))}
+            elif m.group('res') is not None:
+                summary['utilization'][m.group('res').decode()] = {'used': int(m.group('res_used')), 'available': int(m.group('res_avail'))}
+            elif m.group('clock') is not None:
+                summary['clocks'][m.group('clock').decode(errors='replace')] = {
+                    'fmax_mhz': float(m.group('fmax')), 'target_mhz': float(m.group('target')),
+                    'pass': m.group('pass') == b'PASS'}
+            elif m.group('wns') is not None:
+                summary['wns_ns'] = float(m.group('wns'))
+                summary['tns_ns'] = float(m.group('tns'))
+    slacks = [1000 / c['target_mhz'] - 1000 / c['fmax_mhz'] for c in summary['clocks'].values()
+              if c['fmax_mhz'] > 0 and c['target_mhz'] > 0]
+    if summary['wns_ns'] is None and slacks:
+        summary['wns_ns'] = round(min(slacks), 3)
+    return summary
+
+def write_summary(proj_dir):
+    """Summarize build/top.log of a project into build/summary.json, return the summary or None without a log"""
+    log = os.path.join(proj_dir, result_dir, result_log_name)
+    if not os.path.isfile(log):
+        return None
+    summary = summarize_log(log)
+    path = os.path.join(proj_dir, result_dir, result_summary_name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(summary, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return summary
+
+def summary_cli(proj_dir):
+    """Command line wrapper of write_summary(), print the summary"""
+    summary = write_summary(proj_dir)
+    if summary is None:
+        print('No %s/%s found in %s!' % (result_dir, result_log_name, proj_dir))
+        sys.exit(1)
+    print(json.dumps(summary, indent=2))
+
+# only do upload and query. mfgen, etc are done by server's caasw
+def submit(conf_file, proj_dir, dryrun, newjobid, fullupload=False, push=False, paralleldl=False, sim=False, follow=False, both=False):
+    import requests
+    print(term_white + "Preparing payload for project..." + term_orig)
+    try:
+        payload = package(conf_file, proj_dir, newjobid, archive=dryrun or fullupload, sim=sim, both=both)
+    except CaasError as e:
+        print(e)
+        sys.exit(1)
+    caas_conf = payload['conf']
+    jobid = payload['jobid']
+    if dryrun:
+        print("Dryrun, stop here.")
+        return
+    print(term_white + "Submitting to compiling server..." + term_orig)
+    servers = rank_servers(caas_servers(caas_conf))
+    while True:
+        start = time.time()
+        server, response = post_job_failover(servers, payload, fullupload)
+        if response is None:
+            return
+
         if response.status_code == 200:
-            result_dir_abs = os.path.join(proj_dir, result_dir)
-            if not os.path.exists(result_dir_abs):
-                os.makedirs(result_dir_abs)
-            with open(os.path.join(result_dir_abs, result_bit_name), "wb") as f:
-                f.write(response.content)
-            print(term_white + "Bitstream downloaded." + term_orig)
+            print("POST done.")
+            reply = json.loads(response.text)
+            if reply['code'] == '0':
+                print("Compilation cannot be submitted: ", reply['msg'])
+                return
+            else:
+                print(term_white + "Compilation submitted, now quering result..." + term_orig)
         else:
-            print("Request failed: ", response.status_status)
-    except Exception as e:
-        requestexp(e)
+            print("POST failed with code", response.status_code)
+            return
+        registry_update(jobid, server=server, proj_dir=os.path.abspath(proj_dir), state='running',
+                        submitted_at=start, upload_seconds=time.time() - start)
+
+        status = wait_status(server, jobid, push, follow=follow)
+        if status is not None:
+            break
+        server_record(server, failed=True)
+        servers = servers[servers.index(server) + 1:]
+        if not servers:
+            print(term_white + "Network error when fetching result, 'caasw.py watch' picks the job up again." + term_orig)
+            return
+        print(term_white + "Server %s stopped answering, submitting again to the next one..." % server + term_orig)
+
+    success = 'succeeded' in status
+    registry_update(jobid, state='succeeded' if success else 'failed', status=status, finished_at=time.time())
+    if not success:
+        print(term_white + "Compilation failed." + term_orig)
+    else:
+        print(term_white + "Compilation succeeded, fetching result..." + term_orig)
+
+    download_results(server, jobid, proj_dir, success, parallel=paralleldl,
+                     artifacts=payload_artifacts(payload))
+    registry_update(jobid, downloaded_at=time.time())
+
+async def _submit_many_async(payloads, fullupload, concurrency, push=False):
+    """Submit, poll and download all prepared projects on one pooled session"""
+    import asyncio
+    import requests
+    from requests.adapters import HTTPAdapter
+    loop = asyncio.get_running_loop()
+    # with push every job also parks one thread on its event stream
+    workers = concurrency + (len(payloads) if push else 0)
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers=workers))
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    http.mount('http://', adapter)
+    http.mount('https://', adapter)
+    # limits the number of requests in flight
+    sem = asyncio.Semaphore(concurrency)
+    # server list -> task of (ranked servers, how many of them answered), probed once per run
+    rankings = {}
+
+    async def rank(servers):
+        ranked = await call(rank_servers, list(servers), http)
+        stats = await asyncio.to_thread(server_stats)
+        return (ranked, sum(1 for s in ranked if stats.get(s, {}).get('failures') == 0) or len(ranked))
+
+    async def call(fn, *args, **kwargs):
+        async with sem:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def run_job(result, payload, index):
+        start = time.time()
+        try:
+            await poll_job(result, payload, index)
+        except Exception as e:
+            # one bad server or project must not lose the results of the others
+            result.update(status='error', msg='%s: %s' % (type(e).__name__, e))
+        finally:
+            result['seconds'] = round(time.time() - start, 2)
+
+    async def poll_job(result, payload, index):
+        servers = tuple(caas_servers(payload['conf']))
+        if servers not in rankings:
+            rankings[servers] = asyncio.ensure_future(rank(servers))
+        # jobs are spread over the servers that answered, in ranking order, the rest is for failover
+        ranked, alive = await rankings[servers]
+        first = index % alive
+        order = ranked[first:alive] + ranked[:first] + ranked[alive:]
+        jobid = payload['jobid']
+        start = time.time()
+        server, response = await call(post_job_failover, order, payload, fullupload, http=http)
+        result['server'] = server
+        if response is None:
+            result.update(status='error', msg='POST failed on every server')
+            return
+        if response.status_code != 200:
+            result.update(status='error', msg='POST failed with code %d' % response.status_code)
+            return
+        try:
+            reply = json.loads(response.text)
+            code = reply['code']
+        except (ValueError, KeyError, TypeError):
+            result.update(status='error', msg='Invalid reply from server: %s' % response.text[:200])
+            return
+        if code == '0':
+            result.update(status='rejected', msg=reply.get('msg'))
+            return
+        await asyncio.to_thread(registry_update, jobid, server=server, proj_dir=os.path.abspath(payload['proj_dir']),
+                                state='running', submitted_at=start, upload_seconds=time.time() - start)
+        print("[%s] %s submitted" % (payload['proj_dir'], jobid))
+        status = None
+        if push:
+            # a push connection is idle most of the time, don't let it hold a request slot
+            status = await asyncio.to_thread(wait_status_push, server, jobid, http)
+        if status is None:
+            server_status = urllib.parse.urljoin(server, 'status/' + str(jobid))
+            polls = status_polls()
+            delay = next(polls)
+            while True:
+                await asyncio.sleep(delay)
+                reply = await call(query_status, server_status, http)
+                try:
+                    delay = polls.send(reply)
+                except StopIteration as stop:
+                    status = stop.value
+                    break
+            if status is None:
+                result.update(status='error', msg='Network error when fetching result')
+                return
+        success = 'succeeded' in status
+        await asyncio.to_thread(registry_update, jobid, state='succeeded' if success else 'failed',
+                                status=status, finished_at=time.time())
+        print("[%s] %s %s, fetching result..." % (payload['proj_dir'], jobid, status))
+        artifacts = payload_artifacts(payload)
+        result['downloaded'] = await call(download_results, server, jobid, payload['proj_dir'], success, http=http,
+                                          artifacts=artifacts)
+        await asyncio.to_thread(registry_update, jobid, downloaded_at=time.time())
+        result.update(status='succeeded' if success else 'failed', msg=status)
+
+    results = []
+    tasks = []
+    for index, payload in enumerate(payloads):
+        result = {'dir': payload['proj_dir'], 'jobid': payload['jobid']}
+        results.append(result)
+        tasks.append(run_job(result, payload, index))
+    # every job polls on its own schedule, so the total is about the slowest job
+    await asyncio.gather(*tasks)
+    http.close()
+    return results
 
+def submit_many(proj_dirs, concurrency=16, newjobid=False, fullupload=False, push=False, conf_name=caas_conf_default, sim=False, both=False):
+    """Submit many projects at once, return one result dict per project in order"""
+    import asyncio
+    payloads = []
+    results = []
+    for d in proj_dirs:
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                payloads.append(package(os.path.join(d, conf_name), d, newjobid, archive=fullupload, sim=sim, both=both))
+        except CaasError as e:
+            results.append({'dir': d, 'status': 'error', 'msg': str(e)})
+    results.extend(asyncio.run(_submit_many_async(payloads, fullupload, concurrency, push)))
+    order = {d: i for i, d in enumerate(proj_dirs)}
+    return sorted(results, key=lambda r: order[r['dir']])
+
+def submit_many_cli(spec, concurrency, newjobid, fullupload, push=False, sim=False, both=False):
+    """Command line wrapper of submit_many(), print a JSON summary"""
+    proj_dirs = expand_projects(spec)
+    if not proj_dirs:
+        print('No project directory matches %s!' % spec)
+        sys.exit(1)
+    start = time.time()
+    # progress goes to stderr, so stdout is only the JSON summary
+    with contextlib.redirect_stdout(sys.stderr):
+        results = submit_many(proj_dirs, concurrency or 16, newjobid, fullupload, push, sim=sim, both=both)
+    failed = sum(1 for r in results if r['status'] != 'succeeded')
+    print(json.dumps({'total': len(results), 'succeeded': len(results) - failed, 'failed': failed,
+                      'seconds': round(time.time() - start, 2), 'projects': results}, indent=2))
+    if failed:
+        sys.exit(1)
 
 def clean(proj_dir):
-    for i in [upload_file, download_file, jobid_file, caas_armed_file, GENERIC_MF_NAME, GENERIC_SH_NAME, GENERIC_SIM_SH_NAME, GENERIC_SIM_MF_NAME]:
+    for i in [upload_file, download_file, jobid_file, hash_cache_file, caas_armed_file, GENERIC_MF_NAME, GENERIC_SH_NAME, GENERIC_SIM_SH_NAME, GENERIC_SIM_MF_NAME, GENERIC_BOTH_SH_NAME, GENERIC_BOTH_MF_NAME, CACHE_SH_NAME, STAGE_SH_NAME, EXPLORE_SH_NAME]:
         try:
             os.remove(os.path.join(proj_dir, i))
         except OSError:
@@ -595,18 +2387,30 @@ def clean(proj_dir):
     print("Temp files cleaned for project ", proj_dir)
 
 if __name__ == '__main__':
+    # called as DOCKER_EXEC by the run scripts, the arguments are docker's
+    if len(sys.argv) > 1 and sys.argv[1] == 'pool-exec':
+        sys.exit(pool_exec(sys.argv[2:]))
     aparse = argparse.ArgumentParser(description='FPGAOL CaaS Wizard')
-    aparse.add_argument('op', metavar='OP', type=str, nargs=1, help='Type of operation: mfgen, submit, clean')
+    aparse.add_argument('op', metavar='OP', type=str, nargs=1, help='Type of operation: mfgen, mfgen-batch, validate, submit, submit-many, summary, chipdb-warm, mirror-refresh, watch, status, report, enqueue, worker, pool-exec, pool-clean, clean')
     aparse.add_argument('--makefile', action='store', default='DEFAULT', help='mfgen - Name of generated Makefile')
     aparse.add_argument('--script', action='store', default='DEFAULT', help='mfgen - Name of generated compile script')
-    aparse.add_argument('--backend', action='store', default=None, help='mfgen - Override backend in caas.conf')
+    aparse.add_argument('--backend', action='store', default=None, help='mfgen, validate - Override backend in caas.conf')
     aparse.add_argument('--overwrite', action='store_const', const=True, default=False, help='mfgen - Overwrite existing files')
     aparse.add_argument('--clone', action='store_const', const=True, default=False, help='clone - specify this with mfgen to get source from Git')
     aparse.add_argument('--dryrun', action='store_const', const=True, default=False, help='submit - Prepare submission files but do not upload')
+    aparse.add_argument('--fullupload', action='store_const', const=True, default=False, help='submit - Always upload the whole project zip, skip the upload cache')
+    aparse.add_argument('--push', action='store_const', const=True, default=False, help='submit - Wait for the result on one Server-Sent Events connection instead of polling')
+    aparse.add_argument('--follow', action='store_const', const=True, default=False, help='submit - Print the build log while the job runs')
+    aparse.add_argument('--paralleldl', action='store_const', const=True, default=False, help='submit - Download all result artifacts in parallel')
     aparse.add_argument('--newjobid', action='store_const', const=True, default=False, help='submit - Use a new random jobID')
-    aparse.add_argument('--compile', action='store_const', const=True, default=False, help='Run compile')
-    aparse.add_argument('--sim', action='store_const', const=True, default=False, help='Run simulation')
-    aparse.add_argument('conf', metavar='CONF', type=str, nargs='?', default=caas_conf_default, help='Configuration file (default: %s)' % caas_conf_default)
+    aparse.add_argument('--jobs', action='store', type=int, default=None, help='mfgen-batch, validate - Number of parallel workers (default: CPU count), submit-many - Requests in flight (default: 16), chipdb-warm - Parts built at once (default: 1), worker - Builds at once (default: CPU budget)')
+    aparse.add_argument('--mem', action='store', type=int, default=None, help='worker - Memory budget in GB (default: physical memory minus %d)' % worker_reserved_mem)
+    aparse.add_argument('--cpus', action='store', type=int, default=None, help='worker - CPU budget (default: CPU count)')
+    aparse.add_argument('--pool', action='store_const', const=True, default=False, help='worker - Run builds in warm containers instead of one docker run each')
+    aparse.add_argument('--drain', action='store_const', const=True, default=False, help='worker - Exit once the queue is empty')
+    aparse.add_argument('--compile', action='store_const', const=True, default=False, help='Run compile, with --sim compile and simulate in one job (mfgen, mfgen-batch, submit, submit-many, enqueue)')
+    aparse.add_argument('--sim', action='store_const', const=True, default=False, help='Run simulation, with submit and submit-many submit simulation jobs and fetch their waveform')
+    aparse.add_argument('conf', metavar='CONF', type=str, nargs='?', default=caas_conf_default, help='Configuration file (default: %s), for mfgen-batch, validate, submit-many, report and enqueue a manifest file or glob of project directories, for chipdb-warm a comma separated list or file of parts, for watch and status optional comma separated job ids' % caas_conf_default)
     aparse.add_argument('dir', metavar='DIR', type=str, nargs='?', default='.', help='Project directory (default: .)')
     args = aparse.parse_args()
     # print(args)
@@ -620,17 +2424,61 @@ if __name__ == '__main__':
     mfgen_clone = args.clone
     submit_dryrun = args.dryrun
     submit_newjobid = args.newjobid
+    submit_fullupload = args.fullupload
+    submit_push = args.push
+    submit_paralleldl = args.paralleldl
+    submit_follow = args.follow
     mfgen_compile = args.compile
     mfgen_sim = args.sim
+    # --compile --sim: one job that builds the bitstream and runs the simulation
+    mfgen_both = mfgen_compile and mfgen_sim
+    batch_jobs = args.jobs
     
     # Set correct default makefile name for simulation mode
     if mfgen_makefile == 'DEFAULT':
-        mfgen_makefile = GENERIC_SIM_MF_NAME if mfgen_sim else GENERIC_MF_NAME
+        mfgen_makefile = GENERIC_BOTH_MF_NAME if mfgen_both else GENERIC_SIM_MF_NAME if mfgen_sim else GENERIC_MF_NAME
     if mfgen_script == 'DEFAULT':
-        mfgen_script = GENERIC_SIM_SH_NAME if mfgen_sim else GENERIC_SH_NAME
+        mfgen_script = GENERIC_BOTH_SH_NAME if mfgen_both else GENERIC_SIM_SH_NAME if mfgen_sim else GENERIC_SH_NAME
     if op == 'clean':
         clean(proj_dir)
         sys.exit(0)
+    if op == 'summary':
+        # caasw.py summary DIR, the directory takes the place of the config file
+        summary_cli(conf_file if os.path.isdir(conf_file) else proj_dir)
+        sys.exit(0)
+    if op == 'mfgen-batch':
+        mfgen_batch(conf_file, batch_jobs, mfgen_makefile, mfgen_script, mfgen_backend, mfgen_overwrite, mfgen_clone, mfgen_sim, mfgen_both)
+        sys.exit(0)
+    if op == 'validate':
+        validate_cli(conf_file, batch_jobs, mfgen_backend, mfgen_sim and not mfgen_both)
+        sys.exit(0)
+    if op == 'pool-clean':
+        pool_clean()
+        sys.exit(0)
+    if op == 'enqueue':
+        enqueue_cli(conf_file, mfgen_sim, mfgen_both)
+        sys.exit(0)
+    if op == 'worker':
+        worker_cli(batch_jobs, args.mem, args.cpus, args.drain, args.pool)
+        sys.exit(0)
+    if op == 'report':
+        report_cli(conf_file)
+        sys.exit(0)
+    if op in ('watch', 'status'):
+        spec = '' if conf_file == caas_conf_default else conf_file
+        watch_cli(spec) if op == 'watch' else status_cli(spec)
+        sys.exit(0)
+    if op == 'mirror-refresh':
+        if not os.environ.get(git_mirror_env):
+            print('%s is not set!' % git_mirror_env)
+            sys.exit(1)
+        sys.exit(1 if git_mirror_refresh(os.environ[git_mirror_env]) else 0)
+    if op == 'chipdb-warm':
+        chipdb_warm_cli(conf_file, batch_jobs)
+        sys.exit(0)
+    if op == 'submit-many':
+        submit_many_cli(conf_file, batch_jobs, submit_newjobid, submit_fullupload, submit_push, mfgen_sim, mfgen_both)
+        sys.exit(0)
     if not os.path.isfile(conf_file):
         print('Configuration file %s not found!' % conf_file)
         sys.exit(1)
@@ -638,9 +2486,9 @@ if __name__ == '__main__':
         print('Project directory %s not found!' % proj_dir)
         sys.exit(1)
     if op == 'mfgen':
-        mfgen(conf_file, proj_dir, mfgen_makefile, mfgen_script, mfgen_backend, mfgen_overwrite, mfgen_clone, mfgen_sim)
+        mfgen(conf_file, proj_dir, mfgen_makefile, mfgen_script, mfgen_backend, mfgen_overwrite, mfgen_clone, mfgen_sim, mfgen_both)
     elif op == 'submit':
-        submit(conf_file, proj_dir, submit_dryrun, submit_newjobid)
+        submit(conf_file, proj_dir, submit_dryrun, submit_newjobid, submit_fullupload, submit_push, submit_paralleldl, mfgen_sim, submit_follow, mfgen_both)
     else:
         print('Unknown OP:', op)
         sys.exit(1)
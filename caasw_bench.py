@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Benchmarks of what caasw does for every job.
+# Server side: validate_config_values, the *_derive helpers, template rendering (against the
+# cp + sed -i it replaced) and generate() for every backend template in fpga_tools/. Client side: package() and a submit, status and download round trip
+# against an in-process reference server (caasw_server.py) with instant fake builds.
+# Synthetic projects range from a few to thousands of source files, generated from a fixed seed.
+# Results are printed as JSON (or written with --output), --compare checks them against an
+# earlier run and exits non-zero on a regression.
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+
+import caasw
+
+default_sizes = [4, 64, 1024, 4096]
+quick_sizes = [4, 64]
+default_repeat = 20
+default_seed = 1
+# a result regresses when its median is this much slower than the baseline's
+default_threshold = 1.25
+# medians below this are mostly timer noise and never count as a regression
+compare_floor_ms = 0.05
+# a part per backend that all *_derive helpers understand
+bench_parts = {'ecp5': 'lfe5u-25f-6bg256c', 'gowin': 'GW1NR-LV9QN88PC6\\/I5', 'ice40': 'ice40up5k-sg48',
+               'openxc7': 'xc7a35tcpg236-1', 'vivado': 'xc7a35tcpg236-1'}
+bench_constraints = {'ecp5': 'top.lpf', 'gowin': 'top.cst', 'ice40': 'top.pcf'}
+# simulation templates, rendered by generate(sim=True)
+bench_simulators = ['icarus', 'verilator']
+
+def backends():
+    """Compilation backends with both a Makefile and a script template in fpga_tools/"""
+    names = []
+    for mf in sorted(glob.glob(os.path.join(caasw.TOOLS_DIR, 'Makefile.*'))):
+        backend = os.path.basename(mf)[len('Makefile.'):]
+        if os.path.isfile(os.path.join(caasw.TOOLS_DIR, backend + '.sh')):
+            names.append(backend)
+    return names
+
+def make_project(proj_dir, backend, nfiles, rng, server=caasw.local_server, simulator='icarus'):
+    """Write a synthetic project with nfiles modules in src/, return the caas.conf path"""
+    os.makedirs(os.path.join(proj_dir, 'src'), exist_ok=True)
+    constraint = bench_constraints.get(backend, 'top.xdc')
+    conf = os.path.join(proj_dir, caasw.caas_conf_default)
+    with open(conf, 'w') as f:
+        f.write('[project]\nbackend = %s\npart = %s\ntop = top\nconstraint = %s\nsources = top.v,src/*.v\n\n'
+                '[sim]\ntop = tb\nsimulator = %s\n\n[caas]\nserver = %s\n'
+                % (backend, bench_parts.get(backend, 'xc7a35tcpg236-1'), constraint, simulator, server))
+    with open(os.path.join(proj_dir, 'top.v'), 'w') as f:
+        f.write('module top(input clk, input a, output b);\nassign b = a;\nendmodule\n')
+    with open(os.path.join(proj_dir, constraint), 'w') as f:
+        f.write('# pins\n')
+    for i in range(nfiles):
+        # a few KB of distinct text each, like real sources
+        body = ''.join('  assign w%d = %d\'h%x;\n' % (j, 32, rng.getrandbits(32)) for j in range(rng.randint(20, 120)))
+        with open(os.path.join(proj_dir, 'src', 'mod%d.v' % i), 'w') as f:
+            f.write('module mod%d(output [31:0] w);\n%sendmodule\n' % (i, body))
+    return conf
+
+def measure(fn, repeat, setup=None):
+    """Run fn repeat times with caasw's progress output silenced, return the durations in seconds"""
+    samples = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def summarize(bench, samples, **params):
+    return dict(bench=bench, **params, repeat=len(samples),
+                mean_ms=round(sum(samples) / len(samples) * 1e3, 3),
+                p50_ms=round(caasw.percentile(samples, 50) * 1e3, 3),
+                p99_ms=round(caasw.percentile(samples, 99) * 1e3, 3),
+                min_ms=round(min(samples) * 1e3, 3))
+
+def scaled(repeat, nfiles):
+    """Fewer repetitions for big projects, at least 3"""
+    return max(3, min(repeat, repeat * 64 // max(nfiles, 1)))
+
+def render_values(backend):
+    """A value for every placeholder, without characters sed would need escaped"""
+    values = {name: name.lower() for name in caasw.CAAS_PLACEHOLDERS}
+    values.update(BACKEND=backend, TOP='top', SOURCES=' $(wildcard top.v) ', XDC=' $(wildcard top.xdc) ')
+    return values
+
+def render_sed(mf_t, sh_t, mf, sh, values):
+    """Render a Makefile and script the way mfgen did before render_template: cp, cp and sed -i"""
+    subprocess.run('cp ' + mf_t + ' ' + mf + ' && cp ' + sh_t + ' ' + sh, shell=True, check=True)
+    subprocess.run('sed -i ' + ' '.join("-e 's/__CAAS_%s/%s/g'" % (name, values[name]) for name in caasw.CAAS_PLACEHOLDERS)
+                   + ' ' + mf, shell=True, check=True)
+
+def bench_server_side(workdir, sizes, repeat, rng):
+    results = []
+    for backend in backends():
+        proj = os.path.join(workdir, 'server-%s' % backend)
+        conf_path = make_project(proj, backend, 4, rng)
+        conf = caasw.load_conf(conf_path)
+        results.append(summarize('validate', measure(lambda: caasw.validate_config_values(conf), repeat * 10),
+                                 backend=backend))
+        part = conf['project'].get('part')
+
+        def derive():
+            caasw.xc7family_derive(part, backend)
+            caasw.f4pga_device_derive(part, backend)
+            caasw.ecp5_derive(part, backend)
+            caasw.ice40_derive(part, backend)
+            caasw.gowin_derive(part, backend)
+            caasw.explore_derive(conf, backend)
+        results.append(summarize('derive', measure(derive, repeat * 10), backend=backend))
+        mf_t = os.path.join(caasw.TOOLS_DIR, 'Makefile.' + backend)
+        sh_t = os.path.join(caasw.TOOLS_DIR, backend + '.sh')
+        mf, sh = os.path.join(proj, caasw.GENERIC_MF_NAME), os.path.join(proj, caasw.GENERIC_SH_NAME)
+        values = render_values(backend)
+
+        def render():
+            caasw.render_template(mf_t, mf, values)
+            caasw.render_template(sh_t, sh, values)
+        results.append(summarize('render', measure(render, repeat * 10), backend=backend, variant='cached'))
+        results.append(summarize('render', measure(lambda: render_sed(mf_t, sh_t, mf, sh, values), repeat),
+                                 backend=backend, variant='sed'))
+        for nfiles in sizes:
+            proj = os.path.join(workdir, 'mfgen-%s-%d' % (backend, nfiles))
+            conf_path = make_project(proj, backend, nfiles, rng)
+            results.append(summarize('mfgen', measure(lambda: caasw.generate(conf_path, proj, overwrite=True), repeat),
+                                     backend=backend, files=nfiles))
+    for simulator in bench_simulators:
+        proj = os.path.join(workdir, 'sim-%s' % simulator)
+        conf_path = make_project(proj, 'ice40', 4, rng, simulator=simulator)
+        results.append(summarize('mfgen', measure(lambda: caasw.generate(conf_path, proj, overwrite=True, sim=True), repeat),
+                                 backend='sim-' + simulator, files=4))
+    return results
+
+def bench_client_side(workdir, sizes, repeat, rng):
+    results = []
+    for nfiles in sizes:
+        proj = os.path.join(workdir, 'package-%d' % nfiles)
+        conf_path = make_project(proj, 'ice40', nfiles, rng)
+        hash_cache = os.path.join(proj, caasw.hash_cache_file)
+
+        def drop_hash_cache():
+            if os.path.isfile(hash_cache):
+                os.remove(hash_cache)
+        n = scaled(repeat, nfiles)
+        results.append(summarize('package', measure(lambda: caasw.package(conf_path, proj, archive=False), n, drop_hash_cache),
+                                 variant='manifest-cold', files=nfiles))
+        results.append(summarize('package', measure(lambda: caasw.package(conf_path, proj, archive=False), n),
+                                 variant='manifest-warm', files=nfiles))
+        results.append(summarize('package', measure(lambda: caasw.package(conf_path, proj, archive=True), n),
+                                 variant='zip', files=nfiles))
+    return results
+
+def round_trip(conf_path, proj, fullupload, http):
+    payload = caasw.package(conf_path, proj, newjobid=True, archive=fullupload)
+    server = caasw.caas_servers(payload['conf'])[0]
+    response = caasw.post_job(server, payload, fullupload, http=http)
+    if response.status_code != 200 or json.loads(response.text)['code'] == '0':
+        raise caasw.CaasError('Submission rejected: %s' % response.text)
+    server_status = server + 'status/' + payload['jobid']
+    status = None
+    while status is None or 'running' in status:
+        status, _, _ = caasw.query_status(server_status, http)
+        if status is None:
+            raise caasw.CaasError('Status query failed')
+        if 'running' in status:
+            time.sleep(0.005)
+    if not caasw.download_results(server, payload['jobid'], proj, 'succeeded' in status, http=http):
+        raise caasw.CaasError('Nothing downloaded')
+
+def bench_round_trip(workdir, sizes, repeat, rng):
+    import requests
+    import caasw_server
+    srv = caasw_server.CaasServer(('127.0.0.1', 0), os.path.join(workdir, 'store'), quiet=True,
+                                  fake_seconds=0, fake_bit_size=1 << 16)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    server = 'http://127.0.0.1:%d/' % srv.server_address[1]
+    results = []
+    with requests.Session() as http:
+        for nfiles in sizes:
+            proj = os.path.join(workdir, 'roundtrip-%d' % nfiles)
+            conf_path = make_project(proj, 'ice40', nfiles, rng, server=server)
+            n = scaled(repeat, nfiles)
+            # after the first run the server has every blob, only the manifest goes up
+            results.append(summarize('roundtrip', measure(lambda: round_trip(conf_path, proj, False, http), n),
+                                     variant='manifest', files=nfiles))
+            results.append(summarize('roundtrip', measure(lambda: round_trip(conf_path, proj, True, http), n),
+                                     variant='fullupload', files=nfiles))
+    srv.shutdown()
+    return results
+
+def result_key(result):
+    return (result['bench'], result.get('backend'), result.get('variant'), result.get('files'))
+
+def compare(report, baseline, threshold):
+    """Print the median of every result against the baseline, return the regressed ones"""
+    old = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for r in report['results']:
+        b = old.get(result_key(r))
+        if b is None or b['p50_ms'] < compare_floor_ms:
+            continue
+        ratio = r['p50_ms'] / b['p50_ms']
+        name = ' '.join(str(k) for k in result_key(r) if k is not None)
+        flag = ' REGRESSION' if ratio > threshold else ''
+        print('%-40s %10.3f ms %10.3f ms %6.2fx%s' % (name, b['p50_ms'], r['p50_ms'], ratio, flag), file=sys.stderr)
+        if flag:
+            regressions.append(dict(r, baseline_p50_ms=b['p50_ms'], ratio=round(ratio, 3)))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    aparse = argparse.ArgumentParser(description='Benchmarks of the caasw server and client paths')
+    aparse.add_argument('--sizes', action='store', default=None, help='Comma separated source file counts of the synthetic projects (default: %s)' % ','.join(map(str, default_sizes)))
+    aparse.add_argument('--quick', action='store_const', const=True, default=False, help='Small projects and few repetitions only, for a smoke test')
+    aparse.add_argument('--repeat', action='store', type=int, default=default_repeat, help='Repetitions per benchmark, fewer for big projects (default: %d)' % default_repeat)
+    aparse.add_argument('--only', action='store', default=None, help='Comma separated groups to run: server, client, roundtrip (default: all)')
+    aparse.add_argument('--seed', action='store', type=int, default=default_seed, help='Seed of the synthetic project contents (default: %d)' % default_seed)
+    aparse.add_argument('--output', action='store', default=None, help='Write the JSON report to this file instead of stdout')
+    aparse.add_argument('--compare', action='store', default=None, help='Baseline JSON report, exit non-zero if a median got slower than --threshold')
+    aparse.add_argument('--threshold', action='store', type=float, default=default_threshold, help='Slowdown ratio counted as a regression (default: %.2f)' % default_threshold)
+    args = aparse.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',')] if args.sizes else quick_sizes if args.quick else default_sizes
+    repeat = min(args.repeat, 3) if args.quick else args.repeat
+    groups = args.only.split(',') if args.only else ['server', 'client', 'roundtrip']
+    rng = random.Random(args.seed)
+
+    report = {'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'cpus': os.cpu_count(), 'seed': args.seed, 'sizes': sizes, 'repeat': repeat, 'results': []}
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='caas_bench_') as workdir:
+        # nothing of the benchmark goes to the user's job registry
+        os.environ[caasw.registry_env] = os.path.join(workdir, 'jobs.db')
+        if 'server' in groups:
+            report['results'] += bench_server_side(workdir, sizes, repeat, rng)
+        if 'client' in groups:
+            report['results'] += bench_client_side(workdir, sizes, repeat, rng)
+        if 'roundtrip' in groups:
+            report['results'] += bench_round_trip(workdir, sizes, repeat, rng)
+    report['seconds'] = round(time.perf_counter() - start, 2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report['regressions'] = regressions
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Load generator for the CaaS submit protocol.
+# Many simulated clients each prepare a small project, submit it, poll its status
+# and download the results, using the same functions as caasw submit. Throughput and
+# p50/p99 latency of submit, status and download are printed as JSON. Without --server
+# reference servers (caasw_server.py) with fake builds are started in-process, with
+# --servers more than one, to exercise server ranking and failover (--kill-after).
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+
+import caasw
+
+default_clients = 20
+default_jobs = 2
+
+class Recorder:
+    """Thread-safe collection of latencies per operation"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.outcomes = {}
+        self.servers = {}
+        self.failovers = 0
+        self.errors = []
+
+    def record(self, op, seconds):
+        with self.lock:
+            self.samples.setdefault(op, []).append(seconds)
+
+    def error(self, msg):
+        with self.lock:
+            self.errors.append(msg)
+
+    def outcome(self, status):
+        with self.lock:
+            self.outcomes[status] = self.outcomes.get(status, 0) + 1
+
+    def served(self, server):
+        with self.lock:
+            self.servers[server] = self.servers.get(server, 0) + 1
+
+    def failover(self):
+        with self.lock:
+            self.failovers += 1
+
+    @contextlib.contextmanager
+    def timed(self, op):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(op, time.perf_counter() - start)
+
+    def report(self, wall):
+        ops = {}
+        for op, values in sorted(self.samples.items()):
+            ops[op] = {'count': len(values),
+                       'per_second': round(len(values) / wall, 2),
+                       'mean_ms': round(sum(values) / len(values) * 1e3, 2),
+                       'p50_ms': round(caasw.percentile(values, 50) * 1e3, 2),
+                       'p99_ms': round(caasw.percentile(values, 99) * 1e3, 2),
+                       'max_ms': round(max(values) * 1e3, 2)}
+        jobs = sum(self.outcomes.values())
+        return {'jobs': jobs, 'outcomes': self.outcomes, 'servers': self.servers, 'failovers': self.failovers, 'errors': self.errors[:10], 'wall_seconds': round(wall, 2),
+                'jobs_per_second': round(jobs / wall, 2), 'operations': ops}
+
+def make_project(proj_dir, server, client, backend, part, nfiles):
+    """Write a synthetic project, sources differ per client so the upload cache sees new files"""
+    os.makedirs(proj_dir, exist_ok=True)
+    with open(os.path.join(proj_dir, caasw.caas_conf_default), 'w') as f:
+        f.write('[project]\nbackend = %s\npart = %s\n\n[caas]\nserver = %s\n' % (backend, part, server))
+    for i in range(nfiles):
+        with open(os.path.join(proj_dir, 'mod%d.v' % i), 'w') as f:
+            f.write('// client %d\nmodule mod%d(input a, output b);\nassign b = a;\nendmodule\n' % (client, i))
+    with open(os.path.join(proj_dir, 'top.v'), 'w') as f:
+        f.write('// client %d\nmodule top(input a, output b);\nassign b = a;\nendmodule\n' % client)
+    with open(os.path.join(proj_dir, 'top.pcf'), 'w') as f:
+        f.write('set_io a 1\nset_io b 2\n')
+
+def wait_job(server, jobid, args, rec, http):
+    """Poll (or wait for a push) until the job finishes, return its status or None if the server went away"""
+    server_status = server + 'status/' + jobid
+    status = None
+    if args.push:
+        with rec.timed('push_wait'):
+            status = caasw.wait_status_push(server, jobid, http)
+    if status is not None:
+        return status
+
+    def query(url, http):
+        with rec.timed('status'):
+            return caasw.query_status(url, http)
+    return caasw.poll_status(server_status, http, query=query, interval=args.poll)
+
+def run_client(client, args, servers, workdir, rec, http):
+    proj_dir = os.path.join(workdir, 'client%d' % client)
+    make_project(proj_dir, ','.join(servers), client, args.backend, args.part, args.files)
+    conf = os.path.join(proj_dir, caasw.caas_conf_default)
+    for _ in range(args.jobs):
+        start = time.perf_counter()
+        try:
+            payload = caasw.package(conf, proj_dir, newjobid=True, archive=args.fullupload)
+            with rec.timed('rank'):
+                order = caasw.rank_servers(servers, http)
+            status = None
+            while order:
+                with rec.timed('submit'):
+                    server, response = caasw.post_job_failover(order, payload, args.fullupload, http=http)
+                if response is None or response.status_code != 200 or json.loads(response.text)['code'] == '0':
+                    break
+                status = wait_job(server, payload['jobid'], args, rec, http)
+                if status is not None:
+                    break
+                # the server went away with the job, submit it again to the next one
+                rec.failover()
+                order = order[order.index(server) + 1:]
+            if status is None:
+                rec.outcome('rejected')
+                continue
+            rec.served(server)
+            success = 'succeeded' in status
+            with rec.timed('download'):
+                caasw.download_results(server, payload['jobid'], proj_dir, success, http=http)
+            rec.record('job', time.perf_counter() - start)
+            rec.outcome('succeeded' if success else 'failed')
+        except Exception as e:
+            rec.outcome('error')
+            rec.error('%s: %s' % (type(e).__name__, e))
+
+def main():
+    aparse = argparse.ArgumentParser(description='Load generator for the CaaS submit protocol')
+    aparse.add_argument('--server', action='store', default=None, help='Server URL, or comma separated URLs (default: start reference servers in-process)')
+    aparse.add_argument('--servers', action='store', type=int, default=1, help='In-process reference servers the clients choose from (default: 1)')
+    aparse.add_argument('--kill-after', action='store', type=float, default=None, help='Shut the first in-process server down after this many seconds, to test failover')
+    aparse.add_argument('--clients', action='store', type=int, default=default_clients, help='Simulated clients (default: %d)' % default_clients)
+    aparse.add_argument('--jobs', action='store', type=int, default=default_jobs, help='Jobs per client (default: %d)' % default_jobs)
+    aparse.add_argument('--files', action='store', type=int, default=3, help='Extra source files per project (default: 3)')
+    aparse.add_argument('--backend', action='store', default='ice40', help='Backend of the synthetic projects (default: ice40)')
+    aparse.add_argument('--part', action='store', default='ice40up5k-sg48', help='Part of the synthetic projects (default: ice40up5k-sg48)')
+    aparse.add_argument('--poll', action='store', type=float, default=None, help='Fixed status poll interval (default: caasw backoff)')
+    aparse.add_argument('--push', action='store_const', const=True, default=False, help='Wait on Server-Sent Events instead of polling')
+    aparse.add_argument('--fullupload', action='store_const', const=True, default=False, help='Upload zips instead of using the upload cache')
+    aparse.add_argument('--workers', action='store', type=int, default=8, help='In-process server: parallel builds (default: 8)')
+    aparse.add_argument('--fake-seconds', action='store', type=float, default=1.0, help='In-process server: fake build time (default: 1)')
+    aparse.add_argument('--seed', action='store', type=int, default=None, help='Random seed for poll jitter')
+    args = aparse.parse_args()
+    import requests
+    from requests.adapters import HTTPAdapter
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix='caas_load_') as workdir:
+        # server latencies are remembered in the job registry, keep this run's to itself
+        os.environ[caasw.registry_env] = os.path.join(workdir, 'jobs.db')
+        srvs = []
+        if args.server:
+            servers = [s.strip() for s in args.server.split(',') if s.strip()]
+        else:
+            import caasw_server
+            for i in range(args.servers):
+                srv = caasw_server.CaasServer(('127.0.0.1', 0), os.path.join(workdir, 'store%d' % i), quiet=True,
+                                              workers=args.workers, fake_seconds=args.fake_seconds)
+                threading.Thread(target=srv.serve_forever, daemon=True).start()
+                srvs.append(srv)
+            servers = ['http://127.0.0.1:%d/' % srv.server_address[1] for srv in srvs]
+            if args.kill_after is not None:
+                threading.Timer(args.kill_after, lambda: (srvs[0].shutdown(), srvs[0].server_close())).start()
+        servers = [s if s.endswith('/') else s + '/' for s in servers]
+        http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=args.clients, pool_maxsize=args.clients)
+        http.mount('http://', adapter)
+        http.mount('https://', adapter)
+        rec = Recorder()
+        threads = [threading.Thread(target=run_client, args=(i, args, servers, workdir, rec, http))
+                   for i in range(args.clients)]
+        start = time.perf_counter()
+        # caasw prints progress, keep the report clean
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        wall = time.perf_counter() - start
+        for srv in srvs[1:] if args.kill_after is not None else srvs:
+            srv.shutdown()
+        report = rec.report(wall)
+        report.update(server=args.server or 'in-process', clients=args.clients, jobs_per_client=args.jobs)
+        print(json.dumps(report, indent=2))
+    return 0 if report['outcomes'].get('succeeded', 0) == report['jobs'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
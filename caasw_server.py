@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# Reference CaaS compile server, for testing caasw submit and the protocol offline.
+#   POST /manifest                  {"jobid": ..., "files": {path: sha256}} -> {"code": "1", "missing": [sha256, ...]}
+#   PUT  /blob/<sha256>             raw file content, rejected if the digest doesn't match
+#   POST /submit                    form with inputJobId, either inputZipFile or inputManifest, and inputSim=1 for a simulation,
+#                                   with inputCompile=1 as well for a compilation and simulation in one job
+#   GET  /status/<jobid>            running, finished.succeeded or finished.failed
+#   GET  /status?jobs=<id>,<id>     batch status, {jobid: status or null}
+#   GET  /status/<jobid>/events     the same as Server-Sent Events, until the job finishes
+#   GET  /load                      {"queued": n, "running": n, "workers": n}, for clients choosing a server
+#   GET  /download/<jobid>/<name>   log, bitstream, simlog or wave, with Range, ETag and X-Checksum-Sha256,
+#                                   logs and VCD waveforms compressed on the fly for Accept-Encoding zstd or gzip
+#   GET  /download/<jobid>/log?offset=<n>   the log (or simlog) from byte n on, also while the job runs,
+#                                   with the next offset in X-Log-Offset and the status in X-Job-Status
+# Jobs run caasw.generate() and then either a fake build (default) or a real build command.
+import os
+import re
+import sys
+import io
+import json
+import shutil
+import hashlib
+import zlib
+import zipfile
+import time
+import queue
+import argparse
+import contextlib
+import subprocess
+import urllib.parse
+import threading
+import email.parser
+import email.policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import caasw
+
+default_port = 18888
+default_store = '.caas_server'
+default_workers = 4
+sse_keepalive = 15
+# a fake build logs this many progress lines over its duration
+fake_steps = 4
+download_chunk_size = 1 << 16
+# artifacts that are worth compressing on the way out, unless already compressed (FST)
+compressed_artifacts = {'log', 'simlog', 'wave'}
+# artifacts that can be followed with ?offset= while the job runs, and the most sent per request
+tail_artifacts = {'log', 'simlog'}
+tail_max = 1 << 20
+
+# caasw prints its progress, serialize generate() so job logs don't mix
+mfgen_lock = threading.Lock()
+
+sha256_re = re.compile(r'^[0-9a-f]{64}$')
+jobid_re = re.compile(r'^[0-9a-zA-Z_-]+$')
+
+def pick_encoding(accept):
+    """Content-Encoding to compress a download with for this Accept-Encoding, or None"""
+    codings = [c.split(';')[0].strip().lower() for c in accept.split(',')]
+    if 'zstd' in codings:
+        try:
+            import zstandard
+            return 'zstd'
+        except ImportError:
+            pass
+    return 'gzip' if 'gzip' in codings else None
+
+def safe_relpath(rel):
+    """Reject absolute paths and paths escaping the job directory"""
+    norm = os.path.normpath(rel)
+    return not (os.path.isabs(norm) or norm == '..' or norm.startswith('..' + os.sep))
+
+def parse_form(content_type, body):
+    """Parse a urlencoded or multipart/form-data body into {name: (filename, bytes)}"""
+    if not content_type.startswith('multipart/'):
+        return {k: (None, v[0].encode()) for k, v in urllib.parse.parse_qs(body.decode()).items()}
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+    fields = {}
+    for part in msg.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+class CaasServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # many clients connect at once during load tests
+    request_queue_size = 128
+
+    def __init__(self, addr, store, quiet=False, workers=default_workers, build_cmd=None,
+                 fake_seconds=2.0, fake_bit_size=1 << 16, retry_after=None, sim_build_cmd=None, both_build_cmd=None):
+        super().__init__(addr, CaasHandler)
+        self.quiet = quiet
+        self.store = os.path.abspath(store)
+        self.blob_dir = os.path.join(self.store, 'blobs')
+        self.job_dir = os.path.join(self.store, 'jobs')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.job_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.build_cmd = build_cmd
+        self.sim_build_cmd = sim_build_cmd
+        self.both_build_cmd = both_build_cmd
+        self.fake_seconds = fake_seconds
+        self.fake_bit_size = fake_bit_size
+        self.retry_after = retry_after
+        # jobid -> status, guarded by self.changed
+        self.jobs = {}
+        # jobids of simulation jobs, and of those that also compile, guarded by self.lock
+        self.sim_jobs = set()
+        self.both_jobs = set()
+        self.changed = threading.Condition(self.lock)
+        self.queue = queue.Queue()
+        self.workers = workers
+        # jobs being built, guarded by self.lock
+        self.building = 0
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def has_blob(self, digest):
+        return os.path.isfile(self.blob_path(digest))
+
+    def put_blob(self, digest, data):
+        if hashlib.sha256(data).hexdigest() != digest:
+            return False
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def new_job(self, jobid):
+        """Return an empty directory for the job, replacing a previous run with the same jobID"""
+        d = os.path.join(self.job_dir, jobid)
+        with self.lock:
+            if self.jobs.get(jobid) == 'running':
+                raise RuntimeError('Job %s is still running' % jobid)
+            shutil.rmtree(d, ignore_errors=True)
+            os.makedirs(d)
+        return d
+
+    def materialize_manifest(self, jobid, manifest):
+        """Build the job directory from blobs, return an error message or None"""
+        for rel, digest in manifest.items():
+            if not safe_relpath(rel) or not sha256_re.match(digest):
+                return 'Invalid manifest entry %s' % rel
+            if not self.has_blob(digest):
+                return 'Blob for %s missing' % rel
+        d = self.new_job(jobid)
+        for rel, digest in manifest.items():
+            dst = os.path.join(d, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(self.blob_path(digest), dst)
+        return None
+
+    def materialize_zip(self, jobid, data):
+        d = self.new_job(jobid)
+        zip_path = os.path.join(d, caasw.upload_file)
+        with open(zip_path, 'wb') as f:
+            f.write(data)
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                for name in zf.namelist():
+                    if not safe_relpath(name):
+                        return 'Invalid path %s in archive' % name
+                zf.extractall(d)
+        except zipfile.BadZipFile:
+            return 'Bad zip file'
+        os.remove(zip_path)
+        return None
+
+    def job_submitted(self, jobid, sim=False, both=False):
+        """Queue a job once its directory is ready"""
+        with self.lock:
+            for jobs, member in ((self.sim_jobs, sim), (self.both_jobs, both)):
+                if member:
+                    jobs.add(jobid)
+                else:
+                    jobs.discard(jobid)
+        self.set_status(jobid, 'running')
+        self.queue.put(jobid)
+
+    def set_status(self, jobid, status):
+        with self.changed:
+            self.jobs[jobid] = status
+            self.changed.notify_all()
+
+    def get_status(self, jobid):
+        with self.lock:
+            return self.jobs.get(jobid)
+
+    def wait_status(self, jobid, timeout):
+        """Block until the job is no longer running or timeout, return its status"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.jobs.get(jobid) != 'running', timeout)
+            return self.jobs.get(jobid)
+
+    def load(self):
+        with self.lock:
+            return {'queued': self.queue.qsize(), 'running': self.building, 'workers': self.workers}
+
+    def is_sim(self, jobid):
+        with self.lock:
+            return jobid in self.sim_jobs
+
+    def is_both(self, jobid):
+        with self.lock:
+            return jobid in self.both_jobs
+
+    def artifact_path(self, jobid, name):
+        """Path of a downloadable artifact of a finished job, or None"""
+        d = os.path.join(self.job_dir, jobid)
+        if name == 'log':
+            return os.path.join(d, caasw.result_dir, caasw.result_log_name)
+        if name == 'bitstream':
+            conf = caasw.load_conf(os.path.join(d, caasw.caas_armed_file))
+            bitname = conf['project'].get('bitname', caasw.bitname_default)
+            return os.path.join(d, caasw.result_dir, bitname)
+        if name == 'simlog':
+            return os.path.join(d, caasw.result_dir, caasw.result_sim_log_name)
+        if name == 'wave':
+            conf = caasw.load_conf(os.path.join(d, caasw.caas_armed_file))
+            return os.path.join(d, caasw.result_dir, caasw.sim_wave_name(conf))
+        return None
+
+    def worker(self):
+        while True:
+            jobid = self.queue.get()
+            with self.lock:
+                self.building += 1
+            try:
+                ok = self.build(jobid)
+            except Exception as e:
+                ok = False
+                self.log_job(jobid, 'Internal error: %s' % e)
+            with self.lock:
+                self.building -= 1
+            self.set_status(jobid, 'finished.succeeded' if ok else 'finished.failed')
+
+    def log_job(self, jobid, text):
+        build_dir = os.path.join(self.job_dir, jobid, caasw.result_dir)
+        os.makedirs(build_dir, exist_ok=True)
+        with open(os.path.join(build_dir, caasw.result_log_name), 'a') as f:
+            f.write(text + '\n')
+
+    def build(self, jobid):
+        """Run mfgen and the build for a job, return True if a bitstream (or waveform, or both) was produced"""
+        d = os.path.join(self.job_dir, jobid)
+        both = self.is_both(jobid)
+        sim = self.is_sim(jobid) and not both
+        log = io.StringIO()
+        with mfgen_lock, contextlib.redirect_stdout(log):
+            try:
+                result = caasw.generate(os.path.join(d, caasw.caas_armed_file), d, overwrite=True, clone=True, sim=sim, both=both)
+            except caasw.CaasError as e:
+                print(e)
+                result = None
+        self.log_job(jobid, log.getvalue())
+        if result is None:
+            return False
+        outputs = [name for name, wanted in (('bitstream', not sim), ('wave', sim or both)) if wanted]
+        mode = 'build and simulation' if both else 'simulation' if sim else 'build'
+        build_cmd = self.both_build_cmd if both else self.sim_build_cmd if sim else self.build_cmd
+        if build_cmd:
+            with open(os.path.join(d, caasw.result_dir, 'server.log'), 'w') as f:
+                ret = subprocess.run(build_cmd, shell=True, cwd=d, stdout=f, stderr=subprocess.STDOUT).returncode
+            return ret == 0 and all(os.path.isfile(self.artifact_path(jobid, name)) for name in outputs)
+        # fake build: take some time, logging as it goes, and produce a bitstream-sized file, or a VCD-like text
+        for step in range(fake_steps):
+            time.sleep(self.fake_seconds / fake_steps)
+            self.log_job(jobid, 'Fake %s step %d/%d' % (mode, step + 1, fake_steps))
+        for name in outputs:
+            path = self.artifact_path(jobid, name)
+            with open(path, 'wb') as f:
+                if name == 'wave':
+                    f.write(b''.join(b'#%d\n%d!\n' % (t, t & 1) for t in range(self.fake_bit_size // 8)))
+                else:
+                    f.write(os.urandom(self.fake_bit_size))
+            if name == 'wave':
+                with open(self.artifact_path(jobid, 'simlog'), 'w') as f:
+                    f.write('Fake simulation of %s\n' % os.path.basename(path))
+        self.log_job(jobid, 'Fake %s %s for %s done' % (result['backend'], mode, result['part']))
+        return True
+
+class CaasHandler(BaseHTTPRequestHandler):
+    server_version = 'CaaSReference/1.0'
+
+    def log_message(self, fmt, *args):
+        if not self.server.quiet:
+            super().log_message(fmt, *args)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def reply(self, code, body, content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path == '/manifest':
+            try:
+                req = json.loads(self.read_body())
+                files = req['files']
+            except (ValueError, KeyError, TypeError):
+                return self.reply(400, {'code': '0', 'msg': 'Bad manifest'})
+            missing = sorted(set(d for d in files.values() if not self.server.has_blob(d)))
+            return self.reply(200, {'code': '1', 'missing': missing})
+        if self.path == '/submit':
+            fields = parse_form(self.headers.get('Content-Type', ''), self.read_body())
+            jobid = (fields.get('inputJobId', (None, b''))[1] or b'').decode()
+            if not jobid_re.match(jobid):
+                return self.reply(200, {'code': '0', 'msg': 'Invalid jobID'})
+            try:
+                if 'inputManifest' in fields:
+                    manifest = json.loads(fields['inputManifest'][1])
+                    err = self.server.materialize_manifest(jobid, manifest)
+                elif 'inputZipFile' in fields:
+                    err = self.server.materialize_zip(jobid, fields['inputZipFile'][1])
+                else:
+                    err = 'Nothing submitted'
+            except ValueError:
+                err = 'Bad manifest'
+            except RuntimeError as e:
+                err = str(e)
+            if err:
+                return self.reply(200, {'code': '0', 'msg': err})
+            sim = fields.get('inputSim', (None, b''))[1] == b'1'
+            self.server.job_submitted(jobid, sim=sim, both=sim and fields.get('inputCompile', (None, b''))[1] == b'1')
+            return self.reply(200, {'code': '1', 'msg': 'Submitted'})
+        self.reply(404, {'code': '0', 'msg': 'Not found'})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/load':
+            return self.reply(200, self.server.load())
+        if url.path == '/status':
+            # batch status, one request for all the jobs a client is watching
+            jobids = urllib.parse.parse_qs(url.query).get('jobs', [''])[0].split(',')
+            reply = {j: self.server.get_status(j) for j in jobids if j}
+            retry = self.server.retry_after is not None and 'running' in reply.values()
+            return self.reply(200, reply, headers={'Retry-After': str(self.server.retry_after)} if retry else None)
+        m = re.match(r'^/status/([0-9a-zA-Z_-]+)(/events)?$', self.path)
+        if m:
+            status = self.server.get_status(m.group(1))
+            if status is None:
+                return self.reply(404, 'unknown job', 'text/plain')
+            if m.group(2):
+                return self.send_events(m.group(1))
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(status)))
+            if status == 'running' and self.server.retry_after is not None:
+                self.send_header('Retry-After', str(self.server.retry_after))
+            self.end_headers()
+            self.wfile.write(status.encode())
+            return
+        m = re.match(r'^/download/([0-9a-zA-Z_-]+)/([a-z]+)$', url.path)
+        offset = urllib.parse.parse_qs(url.query).get('offset', [''])[0]
+        if m and offset.isdigit() and m.group(2) in tail_artifacts:
+            return self.send_tail(m.group(1), m.group(2), int(offset))
+        if m:
+            if self.server.get_status(m.group(1)) in (None, 'running'):
+                return self.reply(404, 'not finished', 'text/plain')
+            path = self.server.artifact_path(m.group(1), m.group(2))
+            if path is None or not os.path.isfile(path):
+                return self.reply(404, 'no such artifact', 'text/plain')
+            encoding = None
+            # a resumed download gets the plain bytes, offsets are those of the file
+            if m.group(2) in compressed_artifacts and not path.endswith('.fst') and 'Range' not in self.headers:
+                encoding = pick_encoding(self.headers.get('Accept-Encoding', ''))
+            return self.send_file(path, encoding)
+        self.reply(404, {'code': '0', 'msg': 'Not found'})
+
+    def send_events(self, jobid):
+        """Stream the job status as Server-Sent Events until it finishes"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(b'data: running\n\n')
+        self.wfile.flush()
+        while True:
+            status = self.server.wait_status(jobid, sse_keepalive)
+            if status == 'running':
+                self.wfile.write(b': keep-alive\n\n')
+                self.wfile.flush()
+                continue
+            self.wfile.write(('data: %s\n\n' % status).encode())
+            self.wfile.flush()
+            self.close_connection = True
+            return
+
+    def send_tail(self, jobid, name, offset):
+        """Send a log from offset on, which may still be growing, with the next offset and job status"""
+        # the status first, a finished job's log is complete by the time it is read
+        status = self.server.get_status(jobid)
+        if status is None:
+            return self.reply(404, 'unknown job', 'text/plain')
+        path = self.server.artifact_path(jobid, name)
+        data = b''
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                # a log written again from scratch is followed from its start
+                if offset > os.fstat(f.fileno()).st_size:
+                    offset = 0
+                f.seek(offset)
+                data = f.read(tail_max)
+        self.reply(200, data, 'text/plain; charset=utf-8', {'X-Log-Offset': str(offset + len(data)), 'X-Job-Status': status})
+
+    def send_file(self, path, encoding=None):
+        """Send a file with Range, ETag and SHA-256 checksum support, or compressed with encoding"""
+        st = os.stat(path)
+        etag = '"%x-%x"' % (st.st_size, st.st_mtime_ns)
+        if encoding:
+            return self.send_compressed(path, etag, encoding)
+        size = st.st_size
+        start = 0
+        m = re.match(r'^bytes=(\d+)-$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if m and (if_range is None or if_range == etag):
+            start = int(m.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('X-Checksum-Sha256', caasw.file_sha256(path))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            shutil.copyfileobj(f, self.wfile, download_chunk_size)
+
+    def send_compressed(self, path, etag, encoding):
+        """Send a file compressed on the fly, the length is unknown so the connection ends the body.
+
+        The checksum is that of the file, which is what the client has after decompressing.
+        """
+        if encoding == 'zstd':
+            import zstandard
+            comp = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            comp = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('ETag', etag)
+        self.send_header('X-Checksum-Sha256', caasw.file_sha256(path))
+        self.end_headers()
+        self.close_connection = True
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(download_chunk_size), b''):
+                self.wfile.write(comp.compress(chunk))
+        self.wfile.write(comp.flush())
+
+    def do_PUT(self):
+        m = re.match(r'^/blob/([0-9a-f]{64})$', self.path)
+        if not m:
+            return self.reply(404, {'code': '0', 'msg': 'Not found'})
+        if not self.server.put_blob(m.group(1), self.read_body()):
+            return self.reply(400, {'code': '0', 'msg': 'Digest mismatch'})
+        self.reply(200, {'code': '1'})
+
+if __name__ == '__main__':
+    aparse = argparse.ArgumentParser(description='Reference CaaS compile server')
+    aparse.add_argument('--host', action='store', default='127.0.0.1', help='Address to listen on')
+    aparse.add_argument('--port', action='store', type=int, default=default_port, help='Port to listen on (default: %d)' % default_port)
+    aparse.add_argument('--store', action='store', default=default_store, help='Directory for blobs and jobs (default: %s)' % default_store)
+    aparse.add_argument('--quiet', action='store_const', const=True, default=False, help='Do not log requests')
+    aparse.add_argument('--workers', action='store', type=int, default=default_workers, help='Jobs built at the same time (default: %d)' % default_workers)
+    aparse.add_argument('--build', action='store', default=None, help='Real build command run in the job directory, e.g. ./run_caas.sh (default: fake build)')
+    aparse.add_argument('--sim-build', action='store', default=None, help='Real simulation command run in the job directory, e.g. ./run_sim.sh (default: fake simulation)')
+    aparse.add_argument('--both-build', action='store', default=None, help='Real command for a compilation and simulation in one job, e.g. ./run_both.sh (default: fake build)')
+    aparse.add_argument('--fake-seconds', action='store', type=float, default=2.0, help='Duration of a fake build (default: 2)')
+    aparse.add_argument('--fake-bit-size', action='store', type=int, default=1 << 16, help='Size of a fake bitstream (default: 65536)')
+    aparse.add_argument('--retry-after', action='store', type=int, default=None, help='Send this Retry-After with running status replies')
+    args = aparse.parse_args()
+    server = CaasServer((args.host, args.port), args.store, args.quiet, args.workers, args.build,
+                        args.fake_seconds, args.fake_bit_size, args.retry_after, args.sim_build, args.both_build)
+    print('CaaS reference server at http://%s:%d/, store in %s' % (args.host, args.port, server.store))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,77 @@
+#!/bin/sh
+# SPDX-License-Identifier: MIT
+# Generated from https://github.com/FPGAOL-CE/caas-wizard
+#
+# Content-addressed cache of build stage outputs, shared by jobs through a host
+# directory mounted at ${CAAS_CACHE_DIR:-/cache}. Without that directory every
+# lookup misses and nothing is stored, so builds behave as if there was no cache.
+#
+#   caas_cache.sh key <file>...            print a key over the files and the rest of stdin
+#   caas_cache.sh get <key> <output>...    restore outputs of a previous build, fail on a miss
+#   caas_cache.sh put <key> <output>...    store outputs, evicting least recently used entries
+#   caas_cache.sh stats                    print entries, size and hit/miss counters
+#
+# The total size is limited to ${CAAS_CACHE_MAX:-2048} MB.
+
+dir=${CAAS_CACHE_DIR:-/cache}
+max=${CAAS_CACHE_MAX:-2048}
+
+count() {
+	flock ${dir}/.lock sh -c 'n=$(cat "$1" 2>/dev/null || echo 0); echo $((n + 1)) > "$1"' count ${dir}/.$1
+}
+
+evict() {
+	# entry directories oldest first, a hit touches its entry
+	total=$(du -sk ${dir} | cut -f1)
+	for entry in $(ls -1tr ${dir} 2>/dev/null); do
+		[ ${total} -gt $((max * 1024)) ] || break
+		size=$(du -sk ${dir}/${entry} | cut -f1)
+		rm -rf ${dir}/${entry} && total=$((total - size)) && count evictions
+	done
+}
+
+case "$1" in
+key)
+	shift
+	{ sha256sum "$@"; cat; } | sha256sum | cut -c1-40
+	;;
+get)
+	key=$2; shift 2
+	if [ ! -d ${dir}/${key} ]; then
+		[ -d ${dir} ] && count misses
+		echo "cache miss ${key}"
+		exit 1
+	fi
+	for out in "$@"; do
+		cp ${dir}/${key}/$(basename ${out}) ${out}.tmp && mv ${out}.tmp ${out} || exit 1
+	done
+	touch ${dir}/${key}
+	count hits
+	echo "cache hit ${key}"
+	;;
+put)
+	key=$2; shift 2
+	[ -d ${dir} ] || exit 0
+	[ -d ${dir}/${key} ] && exit 0
+	# assembled aside and renamed, so readers never see a partial entry
+	tmp=$(mktemp -d ${dir}/.put.XXXXXX) || exit 0
+	cp "$@" ${tmp}/ && chmod 777 ${tmp} && mv -T ${tmp} ${dir}/${key} 2>/dev/null || rm -rf ${tmp}
+	# one evictor at a time is enough
+	flock -n ${dir}/.evict sh $0 evict || true
+	;;
+evict)
+	evict
+	;;
+stats)
+	[ -d ${dir} ] || { echo "no cache at ${dir}"; exit 1; }
+	echo "entries: $(ls -1 ${dir} | wc -l)"
+	echo "size_kb: $(du -sk ${dir} | cut -f1)"
+	for c in hits misses evictions; do
+		echo "${c}: $(cat ${dir}/.${c} 2>/dev/null || echo 0)"
+	done
+	;;
+*)
+	echo "usage: $0 key|get|put|stats ..." >&2
+	exit 2
+	;;
+esac
@@ -0,0 +1,57 @@
+#!/bin/sh
+# SPDX-License-Identifier: MIT
+# Generated from https://github.com/FPGAOL-CE/caas-wizard
+#
+#   caas_explore.sh <builddir> <output> <run>...
+#
+# Pick the best of the place-and-route runs in <builddir>/explore/<run>/ and copy
+# its <output> to <builddir>/<output>. A run's worst slack in ns comes from its
+# wns.txt (written by Vivado) or from the "Max frequency for clock" lines of its
+# nextpnr pnr.log. Without any timing, the first successful run wins.
+# The table of all runs is written to <builddir>/explore.txt and printed.
+# Fails if no run produced <output>.
+
+builddir=$1
+out=$2
+shift 2
+table=${builddir}/explore.txt
+best=
+best_slack=
+
+printf '%-24s %-8s %s\n' run result worst_slack_ns > ${table}
+for run in "$@"; do
+	dir=${builddir}/explore/${run}
+	if [ ! -f ${dir}/${out} ]; then
+		printf '%-24s %-8s %s\n' ${run} failed - >> ${table}
+		continue
+	fi
+	if [ -f ${dir}/wns.txt ]; then
+		slack=$(head -n 1 ${dir}/wns.txt)
+	else
+		# the last report of every clock is the routed one
+		slack=$(awk -F"': " '/Max frequency for clock/ {
+			split($2, f, " ")
+			if (f[5] + 0 > 0 && f[1] + 0 > 0) slack[$1] = 1000 / f[5] - 1000 / f[1]
+		}
+		END {
+			n = 0
+			for (c in slack) if (n++ == 0 || slack[c] < worst) worst = slack[c]
+			if (n) printf "%.3f\n", worst
+		}' ${dir}/pnr.log 2>/dev/null)
+	fi
+	case "${slack}" in
+	*[!0-9.-]*) slack= ;;
+	esac
+	printf '%-24s %-8s %s\n' ${run} ok ${slack:--} >> ${table}
+	if [ -z "${best}" ]; then
+		best=${run}
+		best_slack=${slack}
+	elif [ -n "${slack}" ] && { [ -z "${best_slack}" ] || awk "BEGIN {exit !(${slack} > ${best_slack})}"; }; then
+		best=${run}
+		best_slack=${slack}
+	fi
+done
+[ -n "${best}" ] && echo "best: ${best}" >> ${table}
+cat ${table}
+[ -n "${best}" ] || exit 1
+cp ${builddir}/explore/${best}/${out} ${builddir}/${out}
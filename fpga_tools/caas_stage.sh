@@ -0,0 +1,62 @@
+#!/bin/sh
+# SPDX-License-Identifier: MIT
+# Generated from https://github.com/FPGAOL-CE/caas-wizard
+#
+#   caas_stage.sh <metrics.json> <backend> <part> <stage> <command>
+#
+# Run one build stage with sh -c and record its wall time, peak RSS of the
+# processes it ran and exit status. Stages of a build are collected in
+# .metrics.stages (one JSON object per line, tools like Vivado append their own
+# sub-stages there) and metrics.json is rewritten after every stage, also when
+# stages run in parallel. The Makefile sets CAAS_RUN once per make run, the first
+# stage of a new run empties the list, so rebuilds don't count earlier stages again.
+# The exit status of the command is passed on.
+
+metrics=$1
+backend=$2
+part=$3
+stage=$4
+cmd=$5
+dir=$(dirname ${metrics})
+stages=${dir}/.metrics.stages
+mkdir -p ${dir}
+if [ -n "${CAAS_RUN}" ] && [ "$(cat ${dir}/.metrics.run 2>/dev/null)" != "${CAAS_RUN}" ]; then
+	echo ${CAAS_RUN} > ${dir}/.metrics.run
+	: > ${stages}
+fi
+
+rss_file=$(mktemp)
+start=$(date +%s.%N)
+if [ -x /usr/bin/time ] && /usr/bin/time -f %M -o /dev/null true 2>/dev/null; then
+	/usr/bin/time -f %M -o ${rss_file} sh -c "${cmd}"
+	ret=$?
+elif command -v python3 >/dev/null 2>&1; then
+	# the peak RSS of reaped children, same as GNU time reports
+	python3 -c 'import resource, subprocess, sys
+ret = subprocess.call(sys.argv[1], shell=True)
+open(sys.argv[2], "w").write("%d\n" % resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+sys.exit(ret if ret >= 0 else 128 - ret)' "${cmd}" ${rss_file}
+	ret=$?
+else
+	sh -c "${cmd}"
+	ret=$?
+fi
+end=$(date +%s.%N)
+rss=$(tail -n 1 ${rss_file} 2>/dev/null)
+rm -f ${rss_file}
+case "${rss}" in
+''|*[!0-9]*) rss=null ;;
+esac
+
+printf '{"stage": "%s", "start": %.3f, "seconds": %.3f, "peak_rss_kb": %s, "exit": %d}\n' \
+	${stage} ${start} $(awk "BEGIN {print ${end} - ${start}}") ${rss} ${ret} >> ${stages}
+{
+	printf '{"backend": "%s", "part": "%s", "stages": [' "${backend}" "${part}"
+	sep=''
+	while read -r line; do
+		printf '%s\n  %s' "${sep}" "${line}"
+		sep=','
+	done < ${stages}
+	printf '\n]}\n'
+} > ${metrics}.$$ && mv ${metrics}.$$ ${metrics}
+exit ${ret}
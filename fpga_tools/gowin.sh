@@ -5,8 +5,16 @@ else
 	append=""
 fi
 
-${DOCKER_EXEC:-docker} run --pull never -it --rm -m 8G \
+# build stage outputs are cached on the host when this directory exists
+cache=${CAAS_CACHE:-/caas_cache}
+[ -d ${cache} ] && cache_mount="-v ${cache}:/cache" || cache_mount=""
+
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
 	-v `pwd`:/mnt \
+	${cache_mount} -e CAAS_CACHE_MAX \
 	--tmpfs /tmp \
 	--user root \
 	docker.io/regymm/gowin${append} make -C /mnt -f Makefile.caas
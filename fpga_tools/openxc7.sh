@@ -4,9 +4,27 @@ if [[ $(uname -m) == "aarch64"  ]]; then
 else
 	append=""
 fi
+image=docker.io/regymm/openxc7${append}
 
-${DOCKER_EXEC:-docker} run --pull never -it --rm -m 8G \
+# chip databases are cached on the host, keyed by part and toolchain image, in /chipdb
+# when it exists (as on the servers), otherwise in the user's cache directory
+chipdb=${CAAS_CHIPDB:-/chipdb}
+if [ ! -d ${chipdb} ]; then
+	[ -n "${CAAS_CHIPDB}" ] || chipdb=${XDG_CACHE_HOME:-$HOME/.cache}/caas/chipdb
+	mkdir -p ${chipdb}
+fi
+version=$(${DOCKER_EXEC:-docker} image inspect --format '{{.Id}}' ${image} 2>/dev/null | sed 's/^sha256://' | cut -c1-12 || true)
+
+# build stage outputs are cached on the host when this directory exists
+cache=${CAAS_CACHE:-/caas_cache}
+[ -d ${cache} ] && cache_mount="-v ${cache}:/cache" || cache_mount=""
+
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
 	-v `pwd`:/mnt \
-	-v /chipdb:/chipdb \
+	-v ${chipdb}:/chipdb \
+	${cache_mount} -e CAAS_CACHE_MAX \
 	--tmpfs /tmp \
-	docker.io/regymm/openxc7${append} make -C /mnt -f Makefile.caas
+	${image} make -C /mnt -f Makefile.caas CHIPDB_VERSION=${version:-default} "$@"
@@ -0,0 +1,31 @@
+#!/bin/bash -ex
+
+# Compilation and simulation of one job in one container, see Makefile.both
+# Only for backends whose toolchain image also has the simulators
+
+if [[ $(uname -m) == "aarch64" ]]; then
+	append="-arm"
+else
+	append=""
+fi
+
+# build stage outputs and Verilator models are cached on the host when this directory exists
+cache=${CAAS_CACHE:-/caas_cache}
+[ -d ${cache} ] && cache_mount="-v ${cache}:/cache" || cache_mount=""
+
+# place and route runs mostly on one CPU, the simulation gets the others,
+# fractions rounded down
+threads=$(nproc)
+[ -n "${CAAS_CPUS}" ] && threads=${CAAS_CPUS%.*}
+[ "${threads:-0}" -ge 2 ] || threads=2
+sim_threads=$((threads - 1))
+
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+# -k: a failing branch doesn't stop the other one
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
+	-v `pwd`:/mnt \
+	${cache_mount} -e CAAS_CACHE_MAX \
+	--tmpfs /tmp \
+	docker.io/regymm/oss-cad-suite${append} make -C /mnt -f Makefile.both.caas -k -j${threads} JOB_THREADS=${sim_threads}
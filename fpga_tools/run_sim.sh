@@ -10,9 +10,22 @@ else
 	append=""
 fi
 
+# a Verilator model is cached on the host when this directory exists
+cache=${CAAS_CACHE:-/caas_cache}
+[ -d ${cache} ] && cache_mount="-v ${cache}:/cache" || cache_mount=""
+
+# Verilator threads follow the CPUs of the job, fractions rounded down
+threads=$(nproc)
+[ -n "${CAAS_CPUS}" ] && threads=${CAAS_CPUS%.*}
+[ "${threads:-0}" -ge 1 ] || threads=1
+
 # Run simulation using OSS CAD Suite container
 # This container includes Verilator, Icarus Verilog, and other simulation tools
-${DOCKER_EXEC:-docker} run --pull never -it --rm -m 8G \
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
 	-v `pwd`:/mnt \
+	${cache_mount} -e CAAS_CACHE_MAX \
 	--tmpfs /tmp \
-	docker.io/regymm/oss-cad-suite${append} make -C /mnt -f Makefile.sim.caas
\ No newline at end of file
+	docker.io/regymm/oss-cad-suite${append} make -C /mnt -f Makefile.sim.caas JOB_THREADS=${threads}
\ No newline at end of file
@@ -1,6 +1,27 @@
 #!/bin/bash -ex
 
-${DOCKER_EXEC:-docker} run --pull never -it --rm -m 8G \
+# checkpoints of the last build are kept on the host when this directory exists, per
+# project directory, and dropped after CAAS_CHECKPOINTS_DAYS days without a build
+checkpoints=${CAAS_CHECKPOINTS:-/caas_checkpoints}
+key=$(pwd | sha256sum | cut -c1-16)
+if [ -d ${checkpoints} ]; then
+	checkpoint_mount="-v ${checkpoints}:/checkpoints"
+	find ${checkpoints} -mindepth 1 -maxdepth 1 -mtime +${CAAS_CHECKPOINTS_DAYS:-14} -exec rm -rf {} + || true
+	mkdir -p ${checkpoints}/${key} && touch ${checkpoints}/${key}
+else
+	checkpoint_mount=""
+fi
+
+# Vivado threads follow the CPUs of the job, fractions rounded down
+threads=$(nproc)
+[ -n "${CAAS_CPUS}" ] && threads=${CAAS_CPUS%.*}
+[ "${threads:-0}" -ge 1 ] || threads=1
+
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
 	-v `pwd`:/mnt \
+	${checkpoint_mount} \
 	--tmpfs /tmp \
-	docker.io/regymm/vivado-lite make -C /mnt -f Makefile.caas
+	docker.io/regymm/vivado-lite make -C /mnt -f Makefile.caas CHECKPOINT_KEY=${key} VIVADO_THREADS=${threads}
@@ -5,7 +5,10 @@ else
 	append=""
 fi
 
-${DOCKER_EXEC:-docker} run --pull never -it --rm -m 8G \
+# memory and CPUs are sized per job by caasw worker, a terminal is only attached when there is one
+[ -t 0 ] && tty=-it || tty=-i
+
+${DOCKER_EXEC:-docker} run --pull never ${tty} --rm -m ${CAAS_MEM:-8G} ${CAAS_CPUS:+--cpus ${CAAS_CPUS}} \
 	-v `pwd`:/mnt \
 	--tmpfs /tmp \
 	docker.io/regymm/oss-cad-suite${append} make -C /mnt -f Makefile.caas